@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.utils.translation import gettext_lazy
 from django.conf import settings
 
-from .models import IL2StatsServer, PilotStatsPage, SomePilot, PlayerOccurrence
+from .paginators import EstimatedCountPaginator
+from .models import IL2StatsServer, PilotStatsPage, SomePilot, PlayerOccurrence, PlayerSession, PollSnapshot, PopulationRollup, LeaderboardEntry
 
 
 class PilotStatsPageAdmin(admin.ModelAdmin):
@@ -15,13 +16,15 @@ admin.site.register(PilotStatsPage, PilotStatsPageAdmin)
 
 
 class IL2StatsServerAdmin(admin.ModelAdmin):
-    list_display = ("name", "url")
+    list_display = ("name", "url", "poll_interval")
 
 admin.site.register(IL2StatsServer, IL2StatsServerAdmin)
 
 
 class SomePilotAdmin(admin.ModelAdmin):
-    list_display = ("name", "site", "site", "squad_pilot")
+    list_display = ("current_name", "site", "id_on_site", "squad_pilot")
+    list_select_related = ("site", "squad_pilot")
+    search_fields = ("current_name",)
 
 admin.site.register(SomePilot, SomePilotAdmin)
 
@@ -29,16 +32,54 @@ admin.site.register(SomePilot, SomePilotAdmin)
 class PlayerOccurrenceAdmin(admin.ModelAdmin):
     list_display = ("pilot_name", "server", "coalition", "timestamp")
     list_filter = ("server", "coalition", "timestamp")
+    # Drilldowns are index seeks, see PlayerOccurrenceQuerySet.datetimes()
+    date_hierarchy = "timestamp"
+    # Exact counts of tens of millions of rows take ages
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def get_queryset(self, request):
         return super().get_queryset(request).select_related("pilot", "server")
 
     def pilot_name(self, obj):
-        return obj.pilot.name()
+        return obj.pilot.current_name
 
 admin.site.register(PlayerOccurrence, PlayerOccurrenceAdmin)
 
 
+class PlayerSessionAdmin(admin.ModelAdmin):
+    list_display = ("pilot", "server", "coalition", "start_at", "end_at", "sample_count", "is_open")
+    list_filter = ("server", "coalition", "is_open")
+    list_select_related = ("pilot", "server")
+
+admin.site.register(PlayerSession, PlayerSessionAdmin)
+
+
+class PollSnapshotAdmin(admin.ModelAdmin):
+    list_display = ("server", "timestamp", "red_count", "blue_count", "total")
+    list_filter = ("server", "timestamp")
+    list_select_related = ("server",)
+
+admin.site.register(PollSnapshot, PollSnapshotAdmin)
+
+
+class PopulationRollupAdmin(admin.ModelAdmin):
+    list_display = ("server", "resolution", "bucket", "coalition", "min_players", "avg_players", "max_players",
+                    "unique_pilots")
+    list_filter = ("server", "resolution", "coalition", "bucket")
+    list_select_related = ("server",)
+
+admin.site.register(PopulationRollup, PopulationRollupAdmin)
+
+
+class LeaderboardEntryAdmin(admin.ModelAdmin):
+    list_display = ("server", "tour_id", "category", "rank", "pilot", "value")
+    list_filter = ("server", "tour_id", "category")
+    list_select_related = ("server", "pilot")
+
+admin.site.register(LeaderboardEntry, LeaderboardEntryAdmin)
+
+
 # Customize admin page
 admin.site.site_header = gettext_lazy("IL-2 Squad Admin")
 admin.site.site_title = gettext_lazy("IL-2 Squad Admin")
\ No newline at end of file
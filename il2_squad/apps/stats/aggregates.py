@@ -0,0 +1,106 @@
+"""
+Totals of virtual lives (VirtualLife), derived from their sorties.
+
+A life's flight time, kills, wounded flag and points are the sums (for was_wounded: any) of its
+sorties. SortieWriter applies the sorties it writes as deltas; verify_life_totals and
+rebuild_life_totals check and recompute them from scratch.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection
+from .models import POINTS_FIELDS
+
+
+logger = logging.getLogger("management")
+
+# Totals that are summed up from the sorties
+KILL_FIELDS = ("air_kills", "ground_kills", "ship_kills")
+
+# Totals of each life of a pilot, computed from its sorties; lives without sorties get zero totals
+COMPUTED_TOTALS_SQL = f"""
+    SELECT life.id,
+           COALESCE(SUM(sortie.end_at - sortie.start_at), INTERVAL '0') AS flight_time,
+           COALESCE(BOOL_OR(sortie.was_wounded), FALSE) AS was_wounded,
+           {", ".join(f"COALESCE(SUM(sortie.{field}), 0) AS {field}" for field in KILL_FIELDS + POINTS_FIELDS)}
+    FROM stats_virtuallife AS life
+    LEFT JOIN stats_sortie AS sortie ON sortie.virtual_life_id = life.id
+    WHERE life.pilot_id = %s
+    GROUP BY life.id"""
+
+TOTAL_FIELDS = ("flight_time", "was_wounded") + KILL_FIELDS + POINTS_FIELDS
+
+
+def apply_sorties(sorties):
+    """
+    Add newly stored sorties to the totals of their lives, in one statement.
+
+    @param sorties: Sortie objects that are not counted in their lives' totals yet
+    @return: number of updated lives
+    """
+    deltas = defaultdict(lambda: {
+        "flight_time": timedelta(0), "was_wounded": False,
+        **{field: 0 for field in KILL_FIELDS}, **{field: Decimal(0) for field in POINTS_FIELDS},
+    })
+    for sortie in sorties:
+        delta = deltas[sortie.virtual_life_id]
+        delta["flight_time"] += sortie.end_at - sortie.start_at
+        delta["was_wounded"] = delta["was_wounded"] or sortie.was_wounded
+        for field in KILL_FIELDS + POINTS_FIELDS:
+            delta[field] += getattr(sortie, field)
+    if not deltas:
+        return 0
+
+    life_ids = list(deltas)
+    columns = [[deltas[life_id][field] for life_id in life_ids] for field in TOTAL_FIELDS]
+    types = ["interval", "boolean"] + ["integer"] * len(KILL_FIELDS) + ["numeric"] * len(POINTS_FIELDS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE stats_virtuallife AS life
+            SET flight_time = life.flight_time + delta.flight_time,
+                was_wounded = life.was_wounded OR delta.was_wounded,
+                {", ".join(f"{field} = life.{field} + delta.{field}" for field in KILL_FIELDS + POINTS_FIELDS)}
+            FROM unnest(%s::bigint[], {", ".join(f"%s::{type_}[]" for type_ in types)})
+                AS delta(id, {", ".join(TOTAL_FIELDS)})
+            WHERE life.id = delta.id;""", [life_ids] + columns)
+        return cursor.rowcount
+
+
+def verify_life_totals(pilot):
+    """
+    Find the lives of a pilot whose stored totals differ from their sorties, in one query.
+
+    @param pilot: User object
+    @return: list of IDs of the lives with wrong totals
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT life.id
+            FROM stats_virtuallife AS life
+            JOIN ({COMPUTED_TOTALS_SQL}) AS computed ON computed.id = life.id
+            WHERE ({", ".join(f"life.{field}" for field in TOTAL_FIELDS)})
+                  IS DISTINCT FROM ({", ".join(f"computed.{field}" for field in TOTAL_FIELDS)})
+            ORDER BY life.id;""", [pilot.id])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def rebuild_life_totals(pilot):
+    """
+    Recompute the totals of all lives of a pilot from their sorties, in one statement.
+
+    @param pilot: User object
+    @return: number of lives whose totals changed
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE stats_virtuallife AS life
+            SET {", ".join(f"{field} = computed.{field}" for field in TOTAL_FIELDS)}
+            FROM ({COMPUTED_TOTALS_SQL}) AS computed
+            WHERE computed.id = life.id
+              AND ({", ".join(f"life.{field}" for field in TOTAL_FIELDS)})
+                  IS DISTINCT FROM ({", ".join(f"computed.{field}" for field in TOTAL_FIELDS)});""", [pilot.id])
+        return cursor.rowcount
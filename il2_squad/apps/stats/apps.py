@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class StatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stats'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from django.db.models.signals import post_delete, post_save
+        from .caching import invalidate_squad_members
+        # Usernames are matched against the names of online players
+        post_save.connect(invalidate_squad_members, sender=User, dispatch_uid="stats_squad_members_save")
+        post_delete.connect(invalidate_squad_members, sender=User, dispatch_uid="stats_squad_members_delete")
@@ -0,0 +1,19 @@
+"""
+Benchmarks for the stats app; run them with `manage.py benchmark <name>`.
+
+All benchmarks create their own data inside a transaction that is rolled back at the end,
+so they can be run against a development DB without leaving anything behind. Scraper and poller
+benchmarks talk to a local stand-in of an il2stats website (stub_server), never to real servers.
+"""
+from .occurrences import bench_closest_timestamp, bench_player_cnt_at
+from .scraping import bench_import_sorties, bench_online_players
+
+
+# Map benchmark names to functions taking the command's options and an output stream, and
+# returning a list of result dicts
+BENCHMARKS = {
+    "closest_timestamp": bench_closest_timestamp,
+    "player_cnt_at": bench_player_cnt_at,
+    "import_sorties": bench_import_sorties,
+    "online_players": bench_online_players,
+}
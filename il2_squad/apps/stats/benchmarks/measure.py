@@ -0,0 +1,72 @@
+"""
+Measuring and reporting benchmark runs.
+"""
+import time
+import tracemalloc
+from django.db import connection
+
+
+class Measurement(object):
+    """
+    Measures a block of code: wall time, number of DB queries and peak (Python) memory.
+
+    Use as a context manager; queries are counted on the default connection. Tracing memory
+    allocations slows Python code down a bit, which is the same for every run.
+    """
+
+    def __init__(self):
+        self.wall_time = 0.0
+        self.queries = 0
+        self.peak_memory = 0
+        self._wrapper = connection.execute_wrapper(self.count_query)
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        tracemalloc.start()
+        self._wrapper.__enter__()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time = time.perf_counter() - self._started
+        self._wrapper.__exit__(*exc_info)
+        self.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def result(self, items, pages=None, **extra):
+        """
+        Summarise the measurement.
+
+        @param items: number of processed items (sorties, players, lookups, ...)
+        @param pages: number of pages fetched from the stats server, if any
+        @param extra: further values to report, e.g. the benchmark's sizes
+        @return: dict of the reported values
+        """
+        result = dict(extra)
+        result.update({
+            "items": items,
+            "wall s": self.wall_time,
+            "items/s": items / self.wall_time if self.wall_time else 0.0,
+            "queries/item": self.queries / items if items else 0.0,
+            "peak MB": self.peak_memory / 2 ** 20,
+        })
+        if pages is not None:
+            result["pages"] = pages
+            result["pages/s"] = pages / self.wall_time if self.wall_time else 0.0
+        return result
+
+
+def write_results(stdout, results):
+    """
+    Write benchmark results as a table, one row per result.
+    """
+    if not results:
+        return
+    columns = list(results[0])
+    stdout.write("".join(f"{column:>16}" for column in columns))
+    for result in results:
+        stdout.write("".join(f"{result.get(column, ''):>16.3f}" if isinstance(result.get(column), float)
+                             else f"{result.get(column, ''):>16}" for column in columns))
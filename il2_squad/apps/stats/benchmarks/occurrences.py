@@ -0,0 +1,191 @@
+"""
+Benchmarks for PlayerOccurrence lookups.
+"""
+import random
+import statistics
+import time
+from django.db import connection, transaction
+from django.utils import timezone
+from ..models import IL2StatsServer, SomePilot, PlayerOccurrence
+from .measure import Measurement
+
+
+# Poll interval and number of players per poll of the synthetic occurrence history
+POLL_INTERVAL_SECONDS = 300
+PLAYERS_PER_POLL = 80
+
+# The query closest_timestamp used before it was backed by the (server, timestamp) index
+LEGACY_CLOSEST_TIMESTAMP_SQL = """
+    SELECT timestamp, ABS(EXTRACT(EPOCH FROM (timestamp - %s))) AS diff
+    FROM stats_playeroccurrence
+    WHERE server_id = %s
+    ORDER BY diff
+    LIMIT 1;"""
+
+
+class Rollback(Exception):
+    """
+    Raised to roll back a benchmark's data.
+    """
+
+
+def create_server(name="Benchmark Server", url="http://127.0.0.1"):
+    """
+    Create a throwaway server for a benchmark.
+    """
+    return IL2StatsServer.objects.create(name=f"{name} {random.randint(0, 10 ** 9)}", url=url)
+
+
+def create_occurrences(server, pilot_ids, first_row, last_row, start):
+    """
+    Insert synthetic occurrences in one statement.
+
+    Rows are numbered; row n belongs to poll n // PLAYERS_PER_POLL, so rows can be added in chunks
+    and the history keeps growing seamlessly.
+
+    @param server: IL2StatsServer object
+    @param pilot_ids: IDs of PLAYERS_PER_POLL pilots
+    @param first_row: number of the first row to create
+    @param last_row: number of the last row to create
+    @param start: timestamp of the first poll
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO stats_playeroccurrence (server_id, pilot_id, timestamp, coalition)
+            SELECT %s,
+                   (%s::bigint[])[1 + g %% %s],
+                   %s + (g / %s) * %s * INTERVAL '1 second',
+                   CASE WHEN g %% 2 = 0 THEN 'red' ELSE 'blue' END
+            FROM generate_series(%s, %s) AS g;""",
+            [server.id, pilot_ids, len(pilot_ids), start, len(pilot_ids), POLL_INTERVAL_SECONDS,
+             first_row, last_row])
+        cursor.execute("ANALYZE stats_playeroccurrence;")
+
+
+def time_calls(func, args_list):
+    """
+    Call a function for each set of arguments and return the latencies in milliseconds.
+    """
+    latencies = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def legacy_closest_timestamp(server, timestamp):
+    with connection.cursor() as cursor:
+        cursor.execute(LEGACY_CLOSEST_TIMESTAMP_SQL, [timestamp, server.id])
+        return cursor.fetchone()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench_closest_timestamp(options, stdout):
+    """
+    Measure PlayerOccurrence.closest_timestamp latency while the table grows.
+
+    Options: `sizes` (row counts to measure at), `lookups` (lookups per size), `legacy` (also
+    measure the unindexed query closest_timestamp used before).
+
+    @return: list of result dicts, one per size
+    """
+    sizes = sorted(options.get("sizes") or [10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7])
+    lookups = options.get("lookups") or 200
+    start = timezone.now() - timezone.timedelta(days=365 * 5)
+
+    columns = ["rows", "median ms", "p95 ms"]
+    if options.get("legacy"):
+        columns += ["legacy median ms", "legacy p95 ms"]
+    stdout.write("".join(f"{column:>18}" for column in columns))
+
+    results = []
+    try:
+        with transaction.atomic():
+            server = create_server()
+            pilots = SomePilot.objects.bulk_create([
+                SomePilot(site=server, id_on_site=-(server.id * 1000 + i)) for i in range(PLAYERS_PER_POLL)
+            ])
+            pilot_ids = [pilot.id for pilot in pilots]
+            rows = 0
+            for size in sizes:
+                create_occurrences(server, pilot_ids, rows, size - 1, start)
+                rows = size
+                # Random timestamps across the whole history, including a bit before and after it
+                span = (rows // PLAYERS_PER_POLL) * POLL_INTERVAL_SECONDS
+                args_list = [
+                    (server, start + timezone.timedelta(seconds=random.uniform(-0.05 * span, 1.05 * span)))
+                    for _ in range(lookups)
+                ]
+                latencies = time_calls(PlayerOccurrence.closest_timestamp, args_list)
+                values = [rows, statistics.median(latencies), percentile(latencies, 0.95)]
+                if options.get("legacy"):
+                    # The legacy query scans the whole history; a few calls are plenty
+                    legacy_latencies = time_calls(legacy_closest_timestamp, args_list[:max(3, lookups // 20)])
+                    values += [statistics.median(legacy_latencies), percentile(legacy_latencies, 0.95)]
+                stdout.write("".join(f"{value:>18}" if isinstance(value, int) else f"{value:>18.3f}"
+                                     for value in values))
+                results.append(dict(zip(columns, values)))
+            raise Rollback()
+    except Rollback:
+        pass
+    return results
+
+
+def create_snapshots(server, first_poll, last_poll, start):
+    """
+    Insert synthetic poll snapshots in one statement; poll n is taken POLL_INTERVAL_SECONDS * n after start.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO stats_pollsnapshot (server_id, timestamp, red_count, blue_count, total)
+            SELECT %s, %s + g * %s * INTERVAL '1 second', g %% 40, g %% 30, g %% 40 + g %% 30
+            FROM generate_series(%s, %s) AS g;""",
+            [server.id, start, POLL_INTERVAL_SECONDS, first_poll, last_poll])
+        cursor.execute("ANALYZE stats_pollsnapshot;")
+
+
+def bench_player_cnt_at(options, stdout):
+    """
+    Measure PlayerOccurrence.player_cnt_at while the history of polls grows, uncached and cached.
+
+    Options: `sizes` (numbers of polls to measure at), `lookups` (lookups per size).
+
+    @return: list of result dicts, one per size and pass
+    """
+    sizes = sorted(options.get("sizes") or [10 ** 4, 10 ** 5, 10 ** 6])
+    lookups = options.get("lookups") or 200
+    start = timezone.now() - timezone.timedelta(days=365 * 5)
+    columns = ["polls", "pass", "median ms", "p95 ms", "queries/item", "peak MB"]
+    stdout.write("".join(f"{column:>18}" for column in columns))
+
+    results = []
+    try:
+        with transaction.atomic():
+            server = create_server()
+            polls = 0
+            for size in sizes:
+                create_snapshots(server, polls, size - 1, start)
+                polls = size
+                span = polls * POLL_INTERVAL_SECONDS
+                args_list = [(server, start + timezone.timedelta(seconds=random.uniform(0, span)))
+                             for _ in range(lookups)]
+                # The second pass is answered from the cache
+                for name in ("cold", "cached"):
+                    with Measurement() as measurement:
+                        latencies = time_calls(PlayerOccurrence.player_cnt_at, args_list)
+                    values = [polls, name, statistics.median(latencies), percentile(latencies, 0.95),
+                              measurement.queries / lookups, measurement.peak_memory / 2 ** 20]
+                    stdout.write("".join(f"{value:>18.3f}" if isinstance(value, float) else f"{value:>18}"
+                                         for value in values))
+                    results.append(dict(zip(columns, values)))
+            raise Rollback()
+    except Rollback:
+        pass
+    return results
@@ -0,0 +1,87 @@
+"""
+Benchmarks of the sortie import and the online poller against a local il2stats stand-in.
+"""
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Max
+from ..models import PilotStatsPage, Sortie, PlayerOccurrence, SomePilot
+from ..scrapers.sessions import close_sessions
+from .measure import Measurement, write_results
+from .occurrences import Rollback, create_server
+from .stub_server import Il2StatsStub, MAX_PILOTS
+
+
+def bench_import_sorties(options, stdout):
+    """
+    Measure import_sorties: all pilots of a server, all tours, no cache of sortie logs.
+
+    The synthetic sorties get IDs above all stored ones, so none of them is skipped as known or
+    collides with real data. They belong to a throwaway server, so their tours' leaderboards are
+    the benchmark's own, even if real servers have tours with the same IDs.
+
+    Options: `pilots`, `tours`, `sorties` (per pilot and tour), `latency` (ms per page),
+    `concurrency` (parallel requests).
+    """
+    pilots = options.get("pilots") or 10
+    tours = options.get("tours") or 3
+    sorties = options.get("sorties") or 50
+    # Sortie IDs of the stub are pilot number * 10^6 + ..., see stub_server
+    first_pilot = (Sortie.objects.aggregate(Max("sortie_id"))["sortie_id__max"] or 0) // 10 ** 6 + 1
+    if first_pilot + pilots - 1 > MAX_PILOTS:
+        raise ValueError(f"The sortie IDs in the DB leave room for {MAX_PILOTS - first_pilot + 1} pilots at most.")
+    results = []
+    with Il2StatsStub(tours, sorties, latency=(options.get("latency") or 0) / 1000) as stub:
+        try:
+            with transaction.atomic():
+                server = create_server(url=stub.url)
+                users = User.objects.bulk_create([
+                    User(username=f"benchmark-{server.id}-{number}") for number in range(1, pilots + 1)])
+                PilotStatsPage.objects.bulk_create([
+                    PilotStatsPage(pilot=user, server=server, url=stub.pilot_url(number))
+                    for number, user in enumerate(users, first_pilot)])
+                with Measurement() as measurement:
+                    call_command("import_sorties", server=server.name, no_cache=True,
+                                 concurrency=options.get("concurrency"))
+                results.append(measurement.result(
+                    Sortie.objects.filter(pilot__in=users).count(), stub.pages_served,
+                    pilots=pilots, tours=tours, sorties=sorties))
+                raise Rollback()
+        except Rollback:
+            pass
+        finally:
+            close_sessions()
+    write_results(stdout, results)
+    return results
+
+
+def bench_online_players(options, stdout):
+    """
+    Measure online_players: fetching, parsing and storing polls of a server.
+
+    The synthetic players get IDs above all stored pilots' IDs on the site, so they are all new.
+
+    Options: `players` (per poll), `polls`, `latency` (ms per page).
+    """
+    players = options.get("players") or 200
+    polls = options.get("polls") or 20
+    first_player = max(SomePilot.objects.aggregate(Max("id_on_site"))["id_on_site__max"] or 0, 0) + 1
+    results = []
+    with Il2StatsStub(players=players, latency=(options.get("latency") or 0) / 1000,
+                      first_player=first_player) as stub:
+        try:
+            with transaction.atomic():
+                server = create_server(url=stub.url)
+                with Measurement() as measurement:
+                    for _ in range(polls):
+                        call_command("online_players", server=server.name)
+                results.append(measurement.result(
+                    PlayerOccurrence.objects.filter(server=server).count(), stub.pages_served,
+                    players=players, polls=polls))
+                raise Rollback()
+        except Rollback:
+            pass
+        finally:
+            close_sessions()
+    write_results(stdout, results)
+    return results
@@ -0,0 +1,203 @@
+"""
+Local stand-in for an il2stats website, serving synthetic pages for benchmarks.
+
+Pages are generated on request, in the markup the il2stats scraper and online poller parse:
+
+    /en/pilot/<id>/<name>/              pilot page with the tour navigation (nav_tour_items)
+    /en/sorties/<id>/<name>/?tour=<t>   sorties list of a pilot's tour, newest first
+    /en/sortie/log/<sortie id>/?tour=<t> sortie log
+    /en/online                          online players; each poll shows another part of the population
+
+Sortie IDs are pilot * 10^6 + tour * 10^4 + n, so they are unique across pilots and tours; pilots
+with sorties can be numbered from any number up to MAX_PILOTS, so benchmarks can stay clear of the
+sortie IDs in the DB. Online players are numbered from `first_player` on, for the same reason. The
+server runs in a separate process, so its work doesn't compete with the benchmarked code for the
+GIL, and can delay every response by a fixed latency.
+"""
+import datetime
+import multiprocessing
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+# Limits of the sortie ID scheme (Sortie.sortie_id is a 32 bit integer); pilots with sorties are numbered 1..MAX_PILOTS
+MAX_PILOTS = 2146
+MAX_TOURS = 99
+MAX_SORTIES_PER_TOUR = 9999
+
+PILOT_RE = re.compile(r"^/en/pilot/(\d+)/[^/]+/$")
+SORTIES_RE = re.compile(r"^/en/sorties/(\d+)/[^/]+/$")
+SORTIE_LOG_RE = re.compile(r"^/en/sortie/log/(\d+)/$")
+
+# Sorties of a pilot follow each other hourly, starting here
+FIRST_SORTIE_AT = datetime.datetime(2020, 1, 1)
+
+
+def pilot_name(number):
+    """
+    Get the name of a synthetic pilot.
+    """
+    return f"Pilot{number}"
+
+
+def pilot_path(number):
+    """
+    Get the path of a synthetic pilot's stats page.
+    """
+    return f"/en/pilot/{number}/{pilot_name(number)}/"
+
+
+def pilot_page(tours, number):
+    links = "".join(f'<a href="{pilot_path(number)}?tour={tour}">Tour {tour}</a>' for tour in range(1, tours + 1))
+    return f'<html><div id="nav_main"><div class="nav_tour_items">{links}</div></div></html>'
+
+
+def sorties_page(sorties_per_tour, number, tour):
+    rows = "".join(
+        f'<a class="row" href="/en/sortie/{number * 10 ** 6 + tour * 10 ** 4 + n}/?tour={tour}">x</a>'
+        for n in range(sorties_per_tour, 0, -1))
+    return f'<html><div class="content_table">{rows}</div></html>'
+
+
+def sortie_log_page(sortie_id):
+    tour, n = divmod(sortie_id % 10 ** 6, 10 ** 4)
+    start_at = FIRST_SORTIE_AT + datetime.timedelta(hours=tour * 10 ** 4 + n)
+    info = {
+        "Aircraft": ("Bf 109 F-4", "Fw 190 A-3", "Yak-1 s69", "La-5 s8")[sortie_id % 4],
+        "Start": start_at.strftime("%d.%m.%Y %H:%M:%S"),
+        "End": (start_at + datetime.timedelta(minutes=20 + sortie_id % 40)).strftime("%d.%m.%Y %H:%M:%S"),
+        "Air kills": str(sortie_id % 3),
+        "Ground kills": str(sortie_id % 5),
+        "Ship kills": "0",
+        "Score": str(sortie_id % 500),
+        "Status": "Killed" if sortie_id % 17 == 0 else "Landed",
+    }
+    rows = "".join(f'<div class="row"><div class="cell">{label}</div><div class="cell">{value}</div></div>'
+                   for label, value in info.items())
+    return f'<html><div class="sortie_info">{rows}</div></html>'
+
+
+def online_page(players, poll, first_player=1):
+    """
+    Build the online page of a poll: `players` players out of a population of 3 * `players`
+    (numbered from `first_player` on), shifted a bit every poll, half of them on each side.
+    """
+    first = poll * max(1, players // 10)
+    numbers = [(first + i) % (3 * players) + first_player for i in range(players)]
+
+    def coalition(css_class, header, numbers):
+        rows = "".join(f'<a class="row" href="{pilot_path(number)}"><div class="cell">{pilot_name(number)}</div></a>'
+                       for number in numbers)
+        return (f'<div class="{css_class}"><div class="header">{header}</div>'
+                f'<div class="content_table">{rows}</div></div>')
+    half = len(numbers) // 2
+    return (f'<html><div class="online_players">{coalition("online_coal_1", "Allies", numbers[:half])}'
+            f'{coalition("online_coal_2", "Axis", numbers[half:])}</div></html>')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like a real web server; the scrapers pool their connections
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        config = self.server.config
+        url = urlparse(self.path)
+        tour = int(parse_qs(url.query).get("tour", ["0"])[0])
+        if url.path == "/en/online":
+            with self.server.lock:
+                poll = self.server.polls
+                self.server.polls += 1
+            content = online_page(config["players"], poll, config["first_player"])
+        elif match := PILOT_RE.match(url.path):
+            content = pilot_page(config["tours"], int(match.group(1)))
+        elif match := SORTIES_RE.match(url.path):
+            content = sorties_page(config["sorties_per_tour"], int(match.group(1)), tour)
+        elif match := SORTIE_LOG_RE.match(url.path):
+            content = sortie_log_page(int(match.group(1)))
+        else:
+            return self.respond("", status=404)
+
+        if config["latency"]:
+            time.sleep(config["latency"])
+        with self.server.pages.get_lock():
+            self.server.pages.value += 1
+        self.respond(content)
+
+    def respond(self, content, status=200):
+        body = content.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(config, pages, port_pipe):
+    """
+    Run the stub server; the target of the server process.
+
+    @param config: dict of the Il2StatsStub's sizes and latency
+    @param pages: shared counter of served pages
+    @param port_pipe: connection the server's port is sent through once it listens
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.pages = pages
+    server.polls = 0
+    server.lock = threading.Lock()
+    port_pipe.send(server.server_address[1])
+    server.serve_forever()
+
+
+class Il2StatsStub(object):
+    """
+    Runs the stub server in a child process; use as a context manager.
+    """
+
+    def __init__(self, tours=3, sorties_per_tour=20, players=80, latency=0.0, first_player=1):
+        """
+        @param tours: number of tours on the pilot pages
+        @param sorties_per_tour: number of sorties of each pilot in each tour
+        @param players: number of players on the online page
+        @param latency: delay of every page, in seconds
+        @param first_player: number (ID on the site) of the first player of the online pages' population
+        @raise ValueError: if the sortie ID scheme can't hold the sizes
+        """
+        if tours > MAX_TOURS or sorties_per_tour > MAX_SORTIES_PER_TOUR:
+            raise ValueError(f"At most {MAX_TOURS} tours and {MAX_SORTIES_PER_TOUR} sorties per tour are supported.")
+        self.config = {"tours": tours, "sorties_per_tour": sorties_per_tour, "players": players, "latency": latency,
+                       "first_player": first_player}
+        self.pages = multiprocessing.Value("q", 0)
+        self.process = None
+        self.url = None
+
+    def __enter__(self):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=serve, args=(self.config, self.pages, sender), daemon=True)
+        self.process.start()
+        self.url = f"http://127.0.0.1:{receiver.recv()}"
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+
+    @property
+    def pages_served(self):
+        """
+        Number of pages served so far.
+        """
+        return self.pages.value
+
+    def pilot_url(self, number):
+        """
+        Get the URL of a synthetic pilot's stats page.
+        """
+        return self.url + pilot_path(number)
@@ -0,0 +1,144 @@
+"""
+Cache of hot stats lookups, on top of Django's cache framework (settings.CACHES).
+
+Every lookup has its own key scheme and TTL. Entries are invalidated by the writers: names of
+renamed pilots by SomePilotName.track_names, a server's player counts by every ingested poll (by
+bumping the server's generation, which is part of the keys), a tour's leaderboard pages by its
+rebuild, the squad members by saving or deleting users. The TTLs only limit how long entries of
+a cache that missed an invalidation (e.g. a process local cache) can be stale.
+"""
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Alias of the cache (in settings.CACHES) used for stats lookups
+STATS_CACHE = getattr(settings, "STATS_CACHE", "stats")
+# Time to live of the entries, in seconds
+PILOT_NAME_CACHE_TTL = getattr(settings, "PILOT_NAME_CACHE_TTL", 24 * 60 * 60)
+PLAYER_CNT_CACHE_TTL = getattr(settings, "PLAYER_CNT_CACHE_TTL", 60 * 60)
+SQUAD_MEMBERS_CACHE_TTL = getattr(settings, "SQUAD_MEMBERS_CACHE_TTL", 60 * 60)
+LEADERBOARD_CACHE_TTL = getattr(settings, "LEADERBOARD_CACHE_TTL", 24 * 60 * 60)
+
+SQUAD_MEMBERS_KEY = "stats:squad_members"
+
+# Marks a cached None, as cache.get() returns None for missing keys
+MISSING = object()
+
+
+def get_cache():
+    """
+    Get the cache used for stats lookups.
+    """
+    return caches[STATS_CACHE]
+
+
+def pilot_name_key(pilot_id):
+    return f"stats:pilot:{pilot_id}:name"
+
+
+def server_generation_key(server_id):
+    return f"stats:server:{server_id}:generation"
+
+
+def player_cnt_key(server_id, generation, timestamp):
+    return f"stats:server:{server_id}:{generation}:player_cnt:{timestamp.timestamp()}"
+
+
+def tour_generation_key(server_id, tour_id):
+    return f"stats:server:{server_id}:tour:{tour_id}:generation"
+
+
+def leaderboard_key(server_id, tour_id, generation, category, page, per_page):
+    return f"stats:server:{server_id}:tour:{tour_id}:{generation}:leaderboard:{category}:{page}:{per_page}"
+
+
+def get_generation(key):
+    """
+    Get the current generation of a group of entries, starting a new one if there is none.
+
+    Generations never expire; they are part of the keys of their entries, so bumping one
+    invalidates all entries of the group at once.
+
+    @param key: key of the generation
+    @return: generation; an integer
+    """
+    cache = get_cache()
+    generation = cache.get(key)
+    if generation is None:
+        # A fresh generation must not match one that was evicted, hence the time
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(key):
+    """
+    Invalidate all entries of a group by starting a new generation.
+    """
+    get_cache().set(key, time.time_ns(), None)
+
+
+def get_or_set(key, compute, ttl):
+    """
+    Get a cached value, computing and caching it on a miss; None is a valid value.
+
+    @param key: cache key
+    @param compute: function without arguments that computes the value
+    @param ttl: time to live in seconds
+    @return: the value
+    """
+    cache = get_cache()
+    value = cache.get(key, MISSING)
+    if value is MISSING:
+        value = compute()
+        cache.set(key, value, ttl)
+    return value
+
+
+def get_pilot_names(pilot_ids, compute):
+    """
+    Get the current names of pilots, computing the missing ones in one go.
+
+    @param pilot_ids: IDs of SomePilot objects
+    @param compute: function that takes a list of pilot IDs and returns a dict pilot ID -> name
+    @return: dict pilot ID -> name
+    """
+    cache = get_cache()
+    keys = {pilot_name_key(pilot_id): pilot_id for pilot_id in set(pilot_ids)}
+    names = {keys[key]: name for key, name in cache.get_many(keys).items()}
+    missing = [pilot_id for pilot_id in keys.values() if pilot_id not in names]
+    if missing:
+        computed = compute(missing)
+        cache.set_many({pilot_name_key(pilot_id): name for pilot_id, name in computed.items()}, PILOT_NAME_CACHE_TTL)
+        names.update(computed)
+    return names
+
+
+def invalidate_pilot_names(pilot_ids):
+    """
+    Drop the cached names of pilots, e.g. after they were renamed.
+    """
+    if pilot_ids:
+        get_cache().delete_many([pilot_name_key(pilot_id) for pilot_id in pilot_ids])
+
+
+def invalidate_player_cnts(server_id):
+    """
+    Drop the cached player counts of a server, e.g. after a poll was stored.
+    """
+    bump_generation(server_generation_key(server_id))
+
+
+def invalidate_leaderboards(server_id, tour_id):
+    """
+    Drop the cached leaderboard pages of a server's tour, e.g. after it was rebuilt.
+    """
+    bump_generation(tour_generation_key(server_id, tour_id))
+
+
+def invalidate_squad_members(**kwargs):
+    """
+    Drop the cached squad members; a receiver of User's post_save and post_delete signals.
+    """
+    get_cache().delete(SQUAD_MEMBERS_KEY)
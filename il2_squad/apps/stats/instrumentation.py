@@ -0,0 +1,248 @@
+"""
+Per-run instrumentation of the import and polling commands.
+
+While a command runs inside instrument(), the following is recorded:
+
+- HTTP requests per host: number, bytes, latency (time to the response headers) and errors; from a
+  response hook of the shared sessions (scrapers.sessions)
+- timers, e.g. HTML parsing ("parse") and building records from the parsed pages ("extract")
+- DB queries and their time, and rows inserted/updated/deleted per model, per stage; stages are the
+  parts of a command (e.g. "scrape", "write") marked with stage()
+
+At the end a summary is logged; it can also be written as JSON, or as a Prometheus textfile for
+node_exporter's textfile collector. Outside of instrument() all hooks do nothing.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger("management")
+
+# Directory of node_exporter's textfile collector; if set, every instrumented run writes <command>.prom there
+INSTRUMENTATION_PROMETHEUS_DIR = getattr(settings, "INSTRUMENTATION_PROMETHEUS_DIR", None)
+
+# Statements that write rows, and the table they write to
+WRITE_SQL_RE = re.compile(r'^\s*(INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+"?(\w+)"?', re.IGNORECASE)
+OPERATIONS = {"INSERT": "inserted", "UPDATE": "updated", "DELETE": "deleted"}
+# Stage of everything outside of explicit stages
+DEFAULT_STAGE = "other"
+
+# The collector of the running instrumented command
+_current = None
+
+
+class RunStats(object):
+    """
+    Numbers of one instrumented run; filled from several threads.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.started = time.time()
+        self.duration = 0.0
+        self.lock = threading.Lock()
+        # host -> {"requests", "bytes", "seconds", "errors"}
+        self.http = defaultdict(lambda: {"requests": 0, "bytes": 0, "seconds": 0.0, "errors": 0})
+        # timer -> {"count", "seconds"}
+        self.timers = defaultdict(lambda: {"count": 0, "seconds": 0.0})
+        # stage -> {"queries", "seconds"}
+        self.db = defaultdict(lambda: {"queries": 0, "seconds": 0.0})
+        # (stage, model label, operation) -> number of rows
+        self.rows = defaultdict(int)
+        # Only the thread running the command sets stages; DB work happens there
+        self.stages = [DEFAULT_STAGE]
+        self.tables = {model._meta.db_table: model._meta.label for model in apps.get_models()}
+
+    def record_response(self, response, *args, **kwargs):
+        """
+        Record an HTTP response; a `requests` response hook.
+        """
+        host = urlparse(response.url).netloc
+        with self.lock:
+            http = self.http[host]
+            http["requests"] += 1
+            http["bytes"] += len(response.content)
+            http["seconds"] += response.elapsed.total_seconds()
+            if response.status_code >= 400:
+                http["errors"] += 1
+
+    def record_time(self, name, seconds):
+        with self.lock:
+            self.timers[name]["count"] += 1
+            self.timers[name]["seconds"] += seconds
+
+    def record_query(self, execute, sql, params, many, context):
+        """
+        Count a DB query, its time and the rows it wrote; a connection execute wrapper.
+        """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stage = self.stages[-1]
+            self.db[stage]["queries"] += 1
+            self.db[stage]["seconds"] += time.perf_counter() - started
+            match = WRITE_SQL_RE.match(sql)
+            rowcount = getattr(context.get("cursor"), "rowcount", -1)
+            if match and rowcount > 0:
+                operation = OPERATIONS[match.group(1).split()[0].upper()]
+                model = self.tables.get(match.group(2), match.group(2))
+                self.rows[(stage, model, operation)] += rowcount
+
+    def as_dict(self):
+        """
+        Get the numbers as a JSON serializable dict.
+        """
+        rows = defaultdict(lambda: defaultdict(dict))
+        for (stage, model, operation), count in sorted(self.rows.items()):
+            rows[stage][model][operation] = count
+        return {
+            "command": self.command,
+            "started": self.started,
+            "duration_seconds": self.duration,
+            "http": dict(self.http),
+            "timers": dict(self.timers),
+            "db": dict(self.db),
+            "rows": {stage: dict(models) for stage, models in rows.items()},
+        }
+
+    def summary(self):
+        """
+        Get a human readable summary, one line per item.
+        """
+        lines = [f"Run summary of {self.command}: {self.duration:.1f} s"]
+        for host, http in sorted(self.http.items()):
+            average = http["seconds"] / http["requests"] * 1000 if http["requests"] else 0
+            lines.append(f"  HTTP {host}: {http['requests']} requests, {http['bytes'] / 2 ** 20:.2f} MB, "
+                         f"{average:.0f} ms average latency, {http['errors']} errors")
+        for name, timer in sorted(self.timers.items()):
+            lines.append(f"  {name}: {timer['count']} times, {timer['seconds']:.2f} s")
+        for stage, db in sorted(self.db.items()):
+            lines.append(f"  DB {stage}: {db['queries']} queries, {db['seconds']:.2f} s")
+        for (stage, model, operation), count in sorted(self.rows.items()):
+            lines.append(f"  Rows {stage}: {model} {operation} {count}")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """
+        Get the numbers in the Prometheus text exposition format.
+        """
+        metrics = defaultdict(list)
+
+        def add(name, value, **labels):
+            labels = {"command": self.command, **labels}
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+            metrics[name].append(f"{name}{{{label_text}}} {value}")
+
+        add("il2squad_run_timestamp_seconds", self.started)
+        add("il2squad_run_duration_seconds", self.duration)
+        for host, http in self.http.items():
+            add("il2squad_http_requests", http["requests"], host=host)
+            add("il2squad_http_bytes", http["bytes"], host=host)
+            add("il2squad_http_latency_seconds", http["seconds"], host=host)
+            add("il2squad_http_errors", http["errors"], host=host)
+        for name, timer in self.timers.items():
+            add("il2squad_timer_count", timer["count"], timer=name)
+            add("il2squad_timer_seconds", timer["seconds"], timer=name)
+        for stage, db in self.db.items():
+            add("il2squad_db_queries", db["queries"], stage=stage)
+            add("il2squad_db_seconds", db["seconds"], stage=stage)
+        for (stage, model, operation), count in self.rows.items():
+            add("il2squad_db_rows", count, stage=stage, model=model, operation=operation)
+
+        text = []
+        for name, samples in metrics.items():
+            text.append(f"# TYPE {name} gauge")
+            text.extend(samples)
+        return "\n".join(text) + "\n"
+
+
+def write_atomically(path, content):
+    """
+    Write a file so readers never see it half written.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as output:
+        output.write(content)
+    os.replace(temp_path, path)
+
+
+@contextmanager
+def instrument(command, json_path=None, prometheus_path=None):
+    """
+    Instrument a run of a command; logs a summary at the end and optionally writes the numbers.
+
+    @param command: name of the command
+    @param json_path: file to write the numbers to as JSON, if given
+    @param prometheus_path: file to write the numbers to as Prometheus textfile; defaults to
+                            <command>.prom in INSTRUMENTATION_PROMETHEUS_DIR, if that is set
+    @return: context manager yielding the RunStats object
+    """
+    global _current
+    stats = RunStats(command)
+    if prometheus_path is None and INSTRUMENTATION_PROMETHEUS_DIR:
+        prometheus_path = os.path.join(INSTRUMENTATION_PROMETHEUS_DIR, f"{command}.prom")
+    started = time.perf_counter()
+    _current = stats
+    try:
+        with connection.execute_wrapper(stats.record_query):
+            yield stats
+    finally:
+        _current = None
+        stats.duration = time.perf_counter() - started
+        logger.info(stats.summary())
+        if json_path:
+            write_atomically(json_path, json.dumps(stats.as_dict(), indent=2))
+        if prometheus_path:
+            write_atomically(prometheus_path, stats.prometheus())
+
+
+@contextmanager
+def stage(name):
+    """
+    Attribute the DB queries of a block to a stage of the running command.
+    """
+    stats = _current
+    if stats is None:
+        yield
+        return
+    stats.stages.append(name)
+    try:
+        yield
+    finally:
+        stats.stages.pop()
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time of a block to a timer of the running command.
+    """
+    stats = _current
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.record_time(name, time.perf_counter() - started)
+
+
+def record_response(response, *args, **kwargs):
+    """
+    Record an HTTP response in the running command's numbers; a `requests` response hook.
+    """
+    stats = _current
+    if stats is not None:
+        stats.record_response(response)
@@ -0,0 +1,83 @@
+"""
+Per-tour leaderboards (LeaderboardEntry), materialised from the tours' sorties.
+
+Tour IDs are per stats server, so tours are identified by (server ID, tour ID) pairs here. A
+tour's leaderboards (one per category of LEADERBOARD_CATEGORIES) are rebuilt as a whole, with
+one statement that sums up the tour's sorties per pilot and ranks the pilots in every category:
+one pilot's new sortie can move the ranks of all others. Only tours whose sorties changed are
+rebuilt, i.e. the tours written by an import or touched by a re-score.
+"""
+import logging
+from django.db import connection, transaction
+from .caching import invalidate_leaderboards
+from .models import (
+    Sortie, POINTS_FIELDS, LEADERBOARD_CATEGORIES, LEADERBOARD_POINTS, LEADERBOARD_FLIGHT_TIME, LEADERBOARD_SORTIES,
+)
+
+
+logger = logging.getLogger("management")
+
+# Totals of each pilot of a tour, one row per pilot and category
+TOTALS_SQL = f"""
+    SELECT totals.pilot_id, categories.category, categories.value
+    FROM (
+        SELECT sortie.pilot_id,
+               {", ".join(f"SUM(sortie.{field}) AS {field}" for field in POINTS_FIELDS)},
+               SUM(sortie.air_kills) AS air_kills,
+               SUM(sortie.ground_kills) AS ground_kills,
+               SUM(sortie.ship_kills) AS ship_kills,
+               EXTRACT(EPOCH FROM SUM(sortie.end_at - sortie.start_at)) AS flight_time,
+               COUNT(*) AS sorties
+        FROM stats_sortie AS sortie
+        WHERE sortie.server_id = %(server_id)s AND sortie.tour_id = %(tour_id)s
+        GROUP BY sortie.pilot_id
+    ) AS totals
+    CROSS JOIN LATERAL (VALUES
+        ('{LEADERBOARD_POINTS}', {" + ".join(f"totals.{field}" for field in POINTS_FIELDS)}),
+        {", ".join(f"('{field}', totals.{field})" for field in POINTS_FIELDS)},
+        ('air_kills', totals.air_kills),
+        ('ground_kills', totals.ground_kills),
+        ('ship_kills', totals.ship_kills),
+        ('{LEADERBOARD_FLIGHT_TIME}', totals.flight_time),
+        ('{LEADERBOARD_SORTIES}', totals.sorties)
+    ) AS categories(category, value)"""
+
+REBUILD_SQL = f"""
+    INSERT INTO stats_leaderboardentry (server_id, tour_id, category, pilot_id, value, rank, position)
+    SELECT %(server_id)s, %(tour_id)s, ranked.category, ranked.pilot_id, ranked.value,
+           RANK() OVER (PARTITION BY ranked.category ORDER BY ranked.value DESC),
+           ROW_NUMBER() OVER (PARTITION BY ranked.category ORDER BY ranked.value DESC, ranked.pilot_id)
+    FROM ({TOTALS_SQL}) AS ranked;"""
+
+
+def rebuild_leaderboard(server_id, tour_id):
+    """
+    Rebuild all leaderboards of a tour from its sorties, in one transaction.
+
+    @param server_id: ID of the tour's IL2StatsServer
+    @param tour_id: ID of the tour on the server
+    @return: number of pilots on the tour's leaderboards
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("DELETE FROM stats_leaderboardentry WHERE server_id = %s AND tour_id = %s;", [server_id, tour_id])
+        cursor.execute(REBUILD_SQL, {"server_id": server_id, "tour_id": tour_id})
+        pilots = cursor.rowcount // len(LEADERBOARD_CATEGORIES)
+        transaction.on_commit(lambda: invalidate_leaderboards(server_id, tour_id))
+    logger.info(f"Rebuilt leaderboards of tour {tour_id} on server {server_id} with {pilots} pilots")
+    return pilots
+
+
+def rebuild_leaderboards(tours=None):
+    """
+    Rebuild the leaderboards of some or all tours.
+
+    @param tours: (server ID, tour ID) pairs of the tours to rebuild; if None, all tours with
+                  sorties are rebuilt
+    @return: number of rebuilt tours
+    """
+    if tours is None:
+        tours = Sortie.objects.filter(server__isnull=False).order_by().values_list("server_id", "tour_id").distinct()
+    tours = sorted(set(tours))
+    for server_id, tour_id in tours:
+        rebuild_leaderboard(server_id, tour_id)
+    return len(tours)
@@ -0,0 +1,39 @@
+"""
+Build poll snapshots from stored player occurrences.
+"""
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from stats.models import IL2StatsServer, PollSnapshot
+
+
+logger = logging.getLogger("management")
+
+
+class Command(BaseCommand):
+    help = "Build the player count snapshots of all stored polls from their player occurrences."
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments to the management command.
+        """
+        parser.add_argument(
+            "--server",
+            type=str,
+            help="Server name; if omitted, snapshots of all servers are built.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handle management command to backfill poll snapshots.
+        """
+        server_name = options.get("server")
+        servers = IL2StatsServer.objects.all()
+        if server_name:
+            servers = servers.filter(name=server_name)
+            if not servers:
+                raise CommandError(f"Unknown server: {server_name}")
+
+        for server in servers:
+            # One INSERT ... SELECT per server, so a long backfill shows progress
+            count = PollSnapshot.backfill(server)
+            logger.info(f"Built {count} poll snapshots for server: {server}")
@@ -0,0 +1,102 @@
+"""
+Run benchmarks of the stats app.
+"""
+import json
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from stats.benchmarks import BENCHMARKS
+
+
+logger = logging.getLogger("management")
+
+
+class Command(BaseCommand):
+    help = "Run benchmarks; all benchmark data is rolled back afterwards."
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments to the management command.
+        """
+        parser.add_argument(
+            "benchmark",
+            nargs="*",
+            help=f"Benchmarks to run ({', '.join(BENCHMARKS)}); if omitted, all benchmarks are run.",
+        )
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            help="Table sizes (rows) to measure at.",
+        )
+        parser.add_argument(
+            "--lookups",
+            type=int,
+            help="Number of lookups per measurement.",
+        )
+        parser.add_argument(
+            "--legacy",
+            action="store_true",
+            help="Also measure the legacy implementation, where available.",
+        )
+        parser.add_argument(
+            "--pilots",
+            type=int,
+            help="Number of pilots whose sorties are imported.",
+        )
+        parser.add_argument(
+            "--tours",
+            type=int,
+            help="Number of tours per pilot.",
+        )
+        parser.add_argument(
+            "--sorties",
+            type=int,
+            help="Number of sorties per pilot and tour.",
+        )
+        parser.add_argument(
+            "--players",
+            type=int,
+            help="Number of players per poll of the online page.",
+        )
+        parser.add_argument(
+            "--polls",
+            type=int,
+            help="Number of polls of the online page.",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            help="Latency of the stub stats server per page, in milliseconds.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Maximum number of parallel requests to the stub stats server.",
+        )
+        parser.add_argument(
+            "--output",
+            type=str,
+            help="File the results are appended to, as JSON lines, to compare runs.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handle management command to run benchmarks.
+        """
+        names = options.get("benchmark") or list(BENCHMARKS)
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError(f"Unknown benchmark: {name}")
+
+        run_at = timezone.now().isoformat()
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"Benchmark: {name}"))
+            try:
+                results = BENCHMARKS[name](options, self.stdout)
+            except ValueError as e:
+                raise CommandError(f"Benchmark {name} failed: {e}")
+            if options.get("output"):
+                with open(options["output"], "a") as output:
+                    for result in results:
+                        output.write(json.dumps({"benchmark": name, "run_at": run_at, **result}) + "\n")
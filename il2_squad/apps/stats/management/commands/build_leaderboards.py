@@ -0,0 +1,48 @@
+"""
+Build the per-tour leaderboards from stored sorties.
+"""
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from stats.models import IL2StatsServer, Sortie
+from stats.leaderboards import rebuild_leaderboards
+
+
+logger = logging.getLogger("management")
+
+
+class Command(BaseCommand):
+    help = ("Build the per-tour leaderboards from the stored sorties (import_sorties and rescore_sorties "
+            "keep them up to date afterwards).")
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments to the management command.
+        """
+        parser.add_argument(
+            "--server",
+            type=str,
+            help="Server name; if omitted, the leaderboards of all servers are built.",
+        )
+        parser.add_argument(
+            "--tour",
+            type=int,
+            help="Tour ID; if omitted, the leaderboards of all tours are built.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handle management command to build leaderboards.
+        """
+        tours = None
+        if options.get("server") or options.get("tour") is not None:
+            sorties = Sortie.objects.filter(server__isnull=False)
+            if options.get("server"):
+                server = IL2StatsServer.objects.filter(name=options["server"]).first()
+                if server is None:
+                    raise CommandError(f"Unknown server: {options['server']}")
+                sorties = sorties.filter(server=server)
+            if options.get("tour") is not None:
+                sorties = sorties.filter(tour_id=options["tour"])
+            tours = sorties.order_by().values_list("server_id", "tour_id").distinct()
+        count = rebuild_leaderboards(tours)
+        logger.info(f"Built the leaderboards of {count} tours")
@@ -0,0 +1,49 @@
+"""
+Build population rollups from stored poll snapshots.
+"""
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from stats.models import IL2StatsServer
+from stats.rollups import build_rollups
+
+
+logger = logging.getLogger("management")
+
+
+class Command(BaseCommand):
+    help = ("Build the 5-minute, hourly and daily population rollups from the poll snapshots "
+            "(run backfill_poll_snapshots first for polls stored before snapshots existed).")
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments to the management command.
+        """
+        parser.add_argument(
+            "--server",
+            type=str,
+            help="Server name; if omitted, rollups of all servers are built.",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            help="Only build the rollups of the last N days; if omitted, the whole history is built.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handle management command to build population rollups.
+        """
+        server_name = options.get("server")
+        servers = IL2StatsServer.objects.all()
+        if server_name:
+            servers = servers.filter(name=server_name)
+            if not servers:
+                raise CommandError(f"Unknown server: {server_name}")
+
+        start = None
+        if options.get("days") is not None:
+            start = timezone.now() - timezone.timedelta(days=options["days"])
+        for server in servers:
+            count = build_rollups(server, start)
+            logger.info(f"Built {count} population rollups for server: {server}")
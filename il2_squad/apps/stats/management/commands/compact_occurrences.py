@@ -0,0 +1,39 @@
+"""
+Convert the player occurrence history into player sessions.
+"""
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from stats.models import IL2StatsServer, PlayerSession
+
+
+logger = logging.getLogger("management")
+
+
+class Command(BaseCommand):
+    help = ("Build player sessions from the player occurrences stored before sessions were tracked; "
+            "can be repeated and run while polling.")
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments to the management command.
+        """
+        parser.add_argument(
+            "--server",
+            type=str,
+            help="Server name; if omitted, the history of all servers is compacted.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handle management command to compact player occurrences into sessions.
+        """
+        server_name = options.get("server")
+        servers = IL2StatsServer.objects.all()
+        if server_name:
+            servers = servers.filter(name=server_name)
+            if not servers:
+                raise CommandError(f"Unknown server: {server_name}")
+
+        for server in servers:
+            count = PlayerSession.compact(server)
+            logger.info(f"Built {count} player sessions for server: {server}")
@@ -0,0 +1,32 @@
+"""
+Create monthly partitions of the player occurrence table ahead of time.
+"""
+import logging
+from django.core.management.base import BaseCommand
+from stats.partitions import ensure_partitions, PLAYER_OCCURRENCE_PARTITIONS_AHEAD
+
+
+logger = logging.getLogger("management")
+
+
+class Command(BaseCommand):
+    help = ("Create the player occurrence partitions of the current and the coming months "
+            "(the pollers do this as well).")
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments to the management command.
+        """
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=PLAYER_OCCURRENCE_PARTITIONS_AHEAD,
+            help="Number of months ahead of the current one; overrides PLAYER_OCCURRENCE_PARTITIONS_AHEAD.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handle management command to create player occurrence partitions.
+        """
+        created = ensure_partitions(options["ahead"])
+        logger.info(f"Created {len(created)} partitions")
@@ -1,13 +1,19 @@
 """
 Import pilots' sortie data from il2stats websites.
 """
-import requests
 import logging
+from contextlib import nullcontext
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.contrib.auth.models import User
-from stats.models import IL2StatsServer, PilotStatsPage, Sortie
-from stats.scrapers import get_scraper_class
+from stats.instrumentation import instrument, stage
+from stats.leaderboards import rebuild_leaderboards
+from stats.models import IL2StatsServer, PilotStatsPage
+from stats.scrapers import get_scraper_context
+from stats.scrapers.archive import MODE_RECORD, MODE_REPLAY
+from stats.scrapers.cache import ResponseCache
+from stats.scrapers.sessions import use_archive
+from stats.writers import SortieWriter
 
 logger = logging.getLogger("management")
 
@@ -36,6 +42,45 @@ class Command(BaseCommand):
             type=int,
             help="Tour ID to import data from; if omitted, all tours are checked for updates.",
         )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=None,
+            help="Maximum number of parallel requests per stats server; defaults to settings.SCRAPER_CONCURRENCY.",
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="Don't use the on-disk cache of sortie logs; all pages are downloaded again.",
+        )
+        parser.add_argument(
+            "--record",
+            type=str,
+            help="Record all fetched pages to this archive (a zip file; appended to if it exists); "
+                 "implies --no-cache.",
+        )
+        parser.add_argument(
+            "--replay",
+            type=str,
+            help="Serve all pages from this archive recorded with --record; the network is not used. "
+                 "Implies --no-cache.",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only import sorties newer than the last import; closed, fully imported tours are skipped.",
+        )
+        parser.add_argument(
+            "--stats-json",
+            type=str,
+            help="File to write the run's instrumentation numbers to, as JSON.",
+        )
+        parser.add_argument(
+            "--stats-prometheus",
+            type=str,
+            help="File to write the run's instrumentation numbers to, as Prometheus textfile; "
+                 "defaults to a file in settings.INSTRUMENTATION_PROMETHEUS_DIR, if set.",
+        )
 
     def handle(self, *args, **options):
         """
@@ -44,53 +89,100 @@ class Command(BaseCommand):
         pilot = None
         server = None
 
-        tour_id = getattr(options, "tour", None)
-        server_name = getattr(options, "server", None)
-        pilot_username = getattr(options, "pilot", None)
-
-        # Limit the import to a single pilot?
-        if pilot_username:
-            if server_name:
-                raise CommandError("Cannot specify both pilot and server.")
-            try:
-                pilot = User.objects.get(username=pilot_username)
-                logger.info(f"Importing sortie data for pilot: {pilot}")
-                for stats_page in PilotStatsPage.objects.filter(pilot=pilot).select_related("server", "pilot"):
-                    self.scrape_pilot_stats(stats_page, tour_id)
-
-            except User.DoesNotExist:
-                raise CommandError(f"Pilot {pilot_username} does not exist.")
-
-        # Limit the import to a single server?
-        elif server_name:
-            try:
-                server = IL2StatsServer.objects.get(name=server_name)
-                logger.info(f"Importing sortie data from server: {server}")
-                for stats_page in server.pilotstatspage_set.all():
-                    self.scrape_pilot_stats(stats_page, tour_id)
-            except IL2StatsServer.DoesNotExist:
-                raise CommandError(f"Server {server_name} does not exist.")
-
-        else:
-            # Normal mode, check all servers and all pilots.
-            for server in IL2StatsServer.objects.all():
-                for stats_page in server.pilotstatspage_set.all().select_related("server", "pilot"):
-                    self.scrape_pilot_stats(stats_page, tour_id)
+        tour_id = options.get("tour")
+        server_name = options.get("server")
+        pilot_username = options.get("pilot")
+        concurrency = options.get("concurrency")
+        if concurrency is not None and concurrency < 1:
+            raise CommandError("Concurrency must be at least 1.")
+        if options.get("record") and options.get("replay"):
+            raise CommandError("Cannot both record and replay.")
+        archive = nullcontext()
+        if options.get("record"):
+            archive = use_archive(options["record"], MODE_RECORD)
+        elif options.get("replay"):
+            archive = use_archive(options["replay"], MODE_REPLAY)
+        # Pages served from the cache would be missing in the archive, or not be replayed
+        use_cache = not (options.get("no_cache") or options.get("record") or options.get("replay"))
+        cache = ResponseCache() if use_cache else None
+        incremental = options.get("incremental", False)
+        with archive, instrument("import_sorties", options.get("stats_json"), options.get("stats_prometheus")):
+            # One scraper context per server, shared by all pilots on that server
+            self.contexts = {}
+            writer = SortieWriter()
+
+            # Limit the import to a single pilot?
+            if pilot_username:
+                if server_name:
+                    raise CommandError("Cannot specify both pilot and server.")
+                try:
+                    pilot = User.objects.get(username=pilot_username)
+                    logger.info(f"Importing sortie data for pilot: {pilot}")
+                    for stats_page in PilotStatsPage.objects.filter(pilot=pilot).select_related("server", "pilot"):
+                        context = self.get_context(stats_page.server, concurrency, cache)
+                        self.scrape_pilot_stats(stats_page, context, writer, tour_id, incremental)
+
+                except User.DoesNotExist:
+                    raise CommandError(f"Pilot {pilot_username} does not exist.")
+
+            # Limit the import to a single server?
+            elif server_name:
+                try:
+                    server = IL2StatsServer.objects.get(name=server_name)
+                    logger.info(f"Importing sortie data from server: {server}")
+                    for stats_page in server.pilotstatspage_set.all().select_related("server", "pilot"):
+                        context = self.get_context(stats_page.server, concurrency, cache)
+                        self.scrape_pilot_stats(stats_page, context, writer, tour_id, incremental)
+                except IL2StatsServer.DoesNotExist:
+                    raise CommandError(f"Server {server_name} does not exist.")
+
+            else:
+                # Normal mode, check all servers and all pilots.
+                for server in IL2StatsServer.objects.all():
+                    for stats_page in server.pilotstatspage_set.all().select_related("server", "pilot"):
+                        context = self.get_context(stats_page.server, concurrency, cache)
+                        self.scrape_pilot_stats(stats_page, context, writer, tour_id, incremental)
+
+            if cache is not None:
+                cache.prune()
+            logger.info(f"Imported {writer.created} sorties, skipped {writer.skipped} overlapping sorties")
+            # Only the leaderboards of tours with new sorties have changed
+            with stage("leaderboards"):
+                rebuild_leaderboards(writer.tours)
+
+    def get_context(self, server, concurrency=None, cache=None):
+        """
+        Get the scraper context of a server, creating it on first use.
+
+        @param server: IL2StatsServer object
+        @param concurrency: Optional maximum number of parallel requests to the stats server.
+        @param cache: Optional ResponseCache for sortie logs.
+        """
+        if server.pk not in self.contexts:
+            self.contexts[server.pk] = get_scraper_context(server, concurrency, cache)
+        return self.contexts[server.pk]
 
     @staticmethod
-    def scrape_pilot_stats(stats_page, tour_id=None):
+    def scrape_pilot_stats(stats_page, context, writer, tour_id=None, incremental=False):
         """
         Parse a pilot's stats page on a particular server and import sortie data.
         
         @param stats_page: The statistics page to start scraping at.
+        @param context: Scraper context of the stats page's server.
+        @param writer: SortieWriter to store the scraped sorties with.
         @param tour_id: Optional tour ID to import data from. If None, we import all unseen tours.
+        @param incremental: Only import sorties newer than the last import.
         """
         try:
-            # Determine and initialize server specific scraper
-            scraper = get_scraper_class(stats_page.server.scraper_type)(stats_page)
-            scraper.scrape(tour_id)
+            # Get a server specific scraper from the server's context
+            scraper = context.scraper(stats_page)
+            # Each tour is written in one go before the next one is fetched, so a failing tour
+            # doesn't lose the ones before; tours without new sorties still get their progress recorded
+            with stage("scrape"):
+                for walked_tour_id, records, last_sortie_id, is_complete in scraper.scrape_tours(tour_id, incremental):
+                    with stage("write"):
+                        writer.write_tour(stats_page, walked_tour_id, records, last_sortie_id, is_complete)
 
         except Exception as e:
-            logger.error(f"Failed to initialize scraper: {e}")
+            logger.error(f"Failed to import sorties of {stats_page}: {e}")
             return
-
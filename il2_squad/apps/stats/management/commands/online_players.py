@@ -1,21 +1,19 @@
 """
 Import pilots' sortie data from il2stats websites.
 """
-import requests
-from lxml import html
 import logging
+from contextlib import nullcontext
 from django.core.management.base import BaseCommand, CommandError
-from django.conf import settings
-from django.contrib.auth.models import User
-from stats.models import IL2StatsServer, SomePilot, PlayerOccurrence, COALITION_BLUE, COALITION_RED
-from urllib.parse import urljoin
-from django.utils import timezone
+from stats.models import IL2StatsServer
+from stats.online import fetch_online_players, ingest_online_players
+from stats.instrumentation import instrument, stage
+from stats.partitions import ensure_partitions
+from stats.scrapers.archive import MODE_RECORD, MODE_REPLAY
+from stats.scrapers.sessions import use_archive
 
 
 logger = logging.getLogger("management")
 
-REQUEST_TIMEOUT = getattr(settings, "REQUEST_TIMEOUT", 120)  # seconds; stats servers tend to be slow
-
 
 class Command(BaseCommand):
     help = "Get current online players from il2stats websites."
@@ -33,89 +31,58 @@ class Command(BaseCommand):
             type=str,
             help="Server name; if omitted, all servers' are polled.",
         )
+        parser.add_argument(
+            "--record",
+            type=str,
+            help="Record all fetched pages to this archive (a zip file; appended to if it exists).",
+        )
+        parser.add_argument(
+            "--replay",
+            type=str,
+            help="Serve all pages from this archive recorded with --record; the network is not used. "
+                 "Every replay serves the first recorded poll.",
+        )
+        parser.add_argument(
+            "--stats-json",
+            type=str,
+            help="File to write the run's instrumentation numbers to, as JSON.",
+        )
+        parser.add_argument(
+            "--stats-prometheus",
+            type=str,
+            help="File to write the run's instrumentation numbers to, as Prometheus textfile; "
+                 "defaults to a file in settings.INSTRUMENTATION_PROMETHEUS_DIR, if set.",
+        )
 
     def handle(self, *args, **options):
         """
         Handle management command to get the current online players.
         """
-        server_name = getattr(options, "server", None)
+        server_name = options.get("server")
         servers = IL2StatsServer.objects.all()
         if server_name:
             servers = servers.filter(name=server_name)
-            
-        for server in servers:
-            logger.info(f"Getting online players for server: {server}")
-            # Build online list URL
-            url = urljoin(server.url, "/en/online")
-            response = requests.get(url, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-            tree = html.fromstring(response.content)
-            
-            self.scrape_coalition(server, tree, '//div[@class="online_players"]//div[@class="online_coal_1"]')
-            self.scrape_coalition(server, tree, '//div[@class="online_players"]//div[@class="online_coal_2"]')
-
-    @staticmethod
-    def scrape_coalition(server, tree, xpath):
-        """
-        Scrape a coalition of online players.
-        
-        @param server: IL2StatsServer object
-        @param tree: lxml tree object (parsed HTML page)
-        @param xpath: XPath to the root element of the coalition
-        """
-        # Get coalition root element
-        root_el = tree.xpath(xpath)
-        if not root_el:
-            logger.error(f"Could not find node {xpath}")
-            return
-        root_el = root_el[0]
-
-        now = timezone.now()
-        
-        # header
-        header = root_el.xpath('.//div[@class="header"]')
-        try:
-            coalition_name = header[0].text
-        except Exception as e:
-            logger.error(f"Could not get coalition name: {e}")
-            return
 
-        coalition = COALITION_RED if "allies" in coalition_name.lower() else COALITION_BLUE
-        
-        # Player list
-        for row in root_el.xpath('./div[@class="content_table"]/a[@class="row"]'):
-            href = row.get("href")
-            id_on_site = int(href.strip("/").split("/")[-2])
-            name = row.xpath('./div[@class="cell"]')[0].text
-            logger.info(f"Player {name} ({id_on_site}) in coalition {coalition}")
-            # Check if this player is already in the database
-            if SomePilot.objects.filter(id_on_site=id_on_site).exists():
-                pilot = SomePilot.objects.get(id_on_site=id_on_site)
-            else:
-                pilot = SomePilot.objects.create(
-                    site=server,
-                    id_on_site=id_on_site,
+        if options.get("record") and options.get("replay"):
+            raise CommandError("Cannot both record and replay.")
+        archive = nullcontext()
+        if options.get("record"):
+            archive = use_archive(options["record"], MODE_RECORD)
+        elif options.get("replay"):
+            archive = use_archive(options["replay"], MODE_REPLAY)
 
-                )
-            
-            if coalition == COALITION_RED:
-                pilot.red_occ_count += 1
-            else:
-                pilot.blue_occ_count += 1
-            
-            # Squad member?
-            member = User.objects.filter(username=name)
-            if len(member):
-                pilot.squad_pilot = member[0]
-                
-            pilot.save()
-            pilot.set_current_name(name, href)
-            
-            # Save occurrence
-            PlayerOccurrence.objects.create(
-                pilot=pilot,
-                server=server,
-                coalition=coalition,
-                timestamp=now,
-            )
-            
+        with archive, instrument("online_players", options.get("stats_json"), options.get("stats_prometheus")):
+            # Occurrences of the coming months need their partitions
+            with stage("partitions"):
+                ensure_partitions()
+            for server in servers:
+                logger.info(f"Getting online players for server: {server}")
+                # Parse the whole list first, then store it in bulk
+                try:
+                    self.players, timestamp = fetch_online_players(server)
+                except ValueError as e:
+                    # Not a poll with 0 players; storing it would end all open sessions
+                    logger.error(f"Failed to parse the online page of {server}: {e}")
+                    continue
+                with stage("ingest"):
+                    ingest_online_players(server, self.players, timestamp)
@@ -0,0 +1,191 @@
+"""
+Resident poller for online players on il2stats websites.
+"""
+import logging
+import random
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection
+from stats.models import IL2StatsServer
+from stats.online import fetch_online_players, ingest_online_players
+from stats.partitions import ensure_partitions
+
+
+logger = logging.getLogger("management")
+
+# Random offset (+/- seconds) added to each scheduled poll, so servers don't get polled in lockstep
+ONLINE_POLL_JITTER_SECONDS = getattr(settings, "ONLINE_POLL_JITTER_SECONDS", 10)
+# How often the server list (and the servers' poll intervals) is reloaded from the DB
+ONLINE_POLL_RELOAD_SECONDS = getattr(settings, "ONLINE_POLL_RELOAD_SECONDS", 600)
+# How often a summary of the poll statistics is logged
+ONLINE_POLL_REPORT_SECONDS = getattr(settings, "ONLINE_POLL_REPORT_SECONDS", 3600)
+
+
+class ServerSchedule(object):
+    """
+    Poll schedule and statistics of one server.
+    """
+
+    def __init__(self, server, now):
+        self.server = server
+        # Polls are scheduled on a fixed grid; jitter is applied on top, so it doesn't accumulate
+        self.next_slot = now
+        self.due = now
+        self.in_flight = False
+        self.samples = 0
+        self.late = 0
+        self.missed = 0
+        self.errors = 0
+
+    @property
+    def interval(self):
+        return max(1, self.server.poll_interval)
+
+    def schedule_next(self, now):
+        """
+        Move on to the next slot; slots that passed while the last poll was running are missed.
+
+        @param now: current time (time.monotonic())
+        @return: number of missed slots
+        """
+        self.next_slot += self.interval
+        missed = 0
+        while self.next_slot < now:
+            self.next_slot += self.interval
+            missed += 1
+        self.missed += missed
+        jitter = min(ONLINE_POLL_JITTER_SECONDS, self.interval / 4)
+        self.due = self.next_slot + random.uniform(-jitter, jitter)
+        return missed
+
+    def __str__(self):
+        return (f"{self.server}: {self.samples} samples, {self.late} late, {self.missed} missed, "
+                f"{self.errors} errors")
+
+
+class Command(BaseCommand):
+    help = "Keep polling online players of il2stats websites, each server on its own interval."
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.schedules = {}
+        self.stop = threading.Event()
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments to the management command.
+        """
+        parser.add_argument(
+            "--server",
+            type=str,
+            action="append",
+            help="Server name; can be given multiple times. If omitted, all servers are polled.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handle management command to poll online players until interrupted.
+        """
+        server_names = options.get("server")
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop.set())
+
+        self.load_servers(server_names)
+        if not self.schedules:
+            raise CommandError("No servers to poll.")
+
+        # One thread per server; fetching runs in threads, all DB work in this thread
+        executor = ThreadPoolExecutor(max_workers=max(4, len(self.schedules)), thread_name_prefix="poller")
+        in_flight = {}
+        next_reload = time.monotonic() + ONLINE_POLL_RELOAD_SECONDS
+        next_report = time.monotonic() + ONLINE_POLL_REPORT_SECONDS
+        try:
+            while not self.stop.is_set():
+                now = time.monotonic()
+                if now >= next_reload:
+                    self.load_servers(server_names)
+                    next_reload = now + ONLINE_POLL_RELOAD_SECONDS
+                if now >= next_report:
+                    self.report()
+                    next_report = now + ONLINE_POLL_REPORT_SECONDS
+
+                # Start due polls; slow servers don't hold up the others
+                for schedule in self.schedules.values():
+                    if schedule.in_flight or now < schedule.due:
+                        continue
+                    delay = now - schedule.due
+                    if delay > schedule.interval / 2:
+                        schedule.late += 1
+                        logger.warning(f"Poll of {schedule.server} is {delay:.0f}s late")
+                    schedule.in_flight = True
+                    in_flight[executor.submit(fetch_online_players, schedule.server)] = schedule
+
+                # Wait for a poll to finish or the next poll to become due
+                next_due = min([schedule.due for schedule in self.schedules.values() if not schedule.in_flight],
+                               default=now + 1)
+                timeout = min(max(0, next_due - time.monotonic()), 1)
+                if in_flight:
+                    done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    done = set()
+                    self.stop.wait(timeout)
+
+                for future in done:
+                    self.finish_poll(in_flight.pop(future), future)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.report()
+
+    def load_servers(self, server_names=None):
+        """
+        (Re)load the servers to poll; schedules of known servers are kept.
+
+        Also creates missing partitions of the occurrence table.
+        """
+        servers = IL2StatsServer.objects.all()
+        if server_names:
+            servers = servers.filter(name__in=server_names)
+        now = time.monotonic()
+        schedules = {}
+        for server in servers:
+            schedule = self.schedules.get(server.pk)
+            if schedule is None:
+                schedule = ServerSchedule(server, now)
+            else:
+                schedule.server = server
+            schedules[server.pk] = schedule
+        self.schedules = schedules
+        logger.info(f"Polling {len(schedules)} servers")
+        # Occurrences of the coming months need their partitions
+        ensure_partitions()
+
+    def finish_poll(self, schedule, future):
+        """
+        Store the result of a finished poll and schedule the next one.
+        """
+        schedule.in_flight = False
+        try:
+            players, timestamp = future.result()
+            # The DB connection is kept open between polls; replace it if it went away
+            if connection.connection is not None and not connection.is_usable():
+                connection.close()
+            ingest_online_players(schedule.server, players, timestamp)
+            schedule.samples += 1
+        except Exception as e:
+            schedule.errors += 1
+            logger.error(f"Failed to poll online players of {schedule.server}: {e}")
+
+        missed = schedule.schedule_next(time.monotonic())
+        if missed:
+            logger.warning(f"Missed {missed} polls of {schedule.server}")
+
+    def report(self):
+        """
+        Log the poll statistics of all servers.
+        """
+        for schedule in self.schedules.values():
+            logger.info(str(schedule))
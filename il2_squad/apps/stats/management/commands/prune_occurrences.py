@@ -0,0 +1,49 @@
+"""
+Delete raw player occurrences older than the retention period.
+"""
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from stats.models import IL2StatsServer
+from stats.rollups import prune_occurrences, PLAYER_OCCURRENCE_RETENTION_DAYS
+
+
+logger = logging.getLogger("management")
+
+
+class Command(BaseCommand):
+    help = ("Delete player occurrences older than PLAYER_OCCURRENCE_RETENTION_DAYS; "
+            "poll snapshots and population rollups are kept.")
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments to the management command.
+        """
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=PLAYER_OCCURRENCE_RETENTION_DAYS,
+            help="Retention period in days; overrides PLAYER_OCCURRENCE_RETENTION_DAYS.",
+        )
+        parser.add_argument(
+            "--server",
+            type=str,
+            help="Server name; if omitted, occurrences of all servers are pruned.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handle management command to prune player occurrences.
+        """
+        days = options.get("days")
+        if days is None:
+            raise CommandError("No retention period: set PLAYER_OCCURRENCE_RETENTION_DAYS or pass --days.")
+        if days < 2:
+            # The current day's rollups are refreshed from raw occurrences
+            raise CommandError("The retention period must be at least 2 days.")
+
+        server = None
+        if options.get("server"):
+            server = IL2StatsServer.objects.filter(name=options["server"]).first()
+            if server is None:
+                raise CommandError(f"Unknown server: {options['server']}")
+        prune_occurrences(days, server)
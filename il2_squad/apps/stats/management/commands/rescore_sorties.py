@@ -0,0 +1,46 @@
+"""
+Score stored sorties again with the current scoring rules.
+"""
+import logging
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from stats.scoring import ScoringEngine, rescore
+
+
+logger = logging.getLogger("management")
+
+
+class Command(BaseCommand):
+    help = "Re-score sorties with the current SCORING_RULES and update the virtual lives' totals."
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments to the management command.
+        """
+        parser.add_argument(
+            "--pilot",
+            type=str,
+            help="Pilot's (user's) name; if omitted, the sorties of all pilots are re-scored.",
+        )
+        parser.add_argument(
+            "--tour",
+            type=int,
+            help="Tour ID; if omitted, all tours are re-scored.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handle management command to re-score sorties.
+        """
+        pilot = None
+        if options.get("pilot"):
+            pilot = User.objects.filter(username=options["pilot"]).first()
+            if pilot is None:
+                raise CommandError(f"Unknown pilot: {options['pilot']}")
+        try:
+            engine = ScoringEngine()
+        except ValueError as e:
+            raise CommandError(f"Invalid scoring rules: {e}")
+
+        count = rescore(engine, pilot=pilot, tour_id=options.get("tour"))
+        logger.info(f"Re-scored {count} sorties")
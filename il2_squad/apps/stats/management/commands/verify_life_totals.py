@@ -0,0 +1,57 @@
+"""
+Verify (and rebuild) the totals of virtual lives from their sorties.
+"""
+import logging
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from stats.aggregates import verify_life_totals, rebuild_life_totals
+
+
+logger = logging.getLogger("management")
+
+
+class Command(BaseCommand):
+    help = "Check the flight time, kills and points of virtual lives against their sorties."
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments to the management command.
+        """
+        parser.add_argument(
+            "--pilot",
+            type=str,
+            help="Pilot's (user's) name; if omitted, all pilots with virtual lives are checked.",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Recompute wrong totals instead of only reporting them.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handle management command to verify or rebuild virtual life totals.
+        """
+        pilots = User.objects.filter(virtuallife__isnull=False).distinct().order_by("username")
+        if options.get("pilot"):
+            pilots = pilots.filter(username=options["pilot"])
+            if not pilots:
+                raise CommandError(f"Unknown pilot or pilot without virtual lives: {options['pilot']}")
+
+        wrong = 0
+        for pilot in pilots:
+            # One query per pilot, either way
+            if options.get("rebuild"):
+                count = rebuild_life_totals(pilot)
+                if count:
+                    logger.info(f"Rebuilt the totals of {count} lives of {pilot}")
+            else:
+                life_ids = verify_life_totals(pilot)
+                count = len(life_ids)
+                if count:
+                    logger.warning(f"Wrong totals of {count} lives of {pilot}: {life_ids}")
+            wrong += count
+
+        if wrong and not options.get("rebuild"):
+            raise CommandError(f"{wrong} lives have wrong totals; run with --rebuild to fix them.")
+        logger.info(f"Checked the lives of {len(pilots)} pilots")
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0003_rename_ul_somepilotname_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TourImportState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tour_id', models.IntegerField()),
+                ('last_sortie_id', models.IntegerField(default=0)),
+                ('is_complete', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('stats_page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stats.pilotstatspage')),
+            ],
+            options={
+                'verbose_name': 'Tour Import State',
+                'verbose_name_plural': 'Tour Import States',
+                'unique_together': {('stats_page', 'tour_id')},
+            },
+        ),
+    ]
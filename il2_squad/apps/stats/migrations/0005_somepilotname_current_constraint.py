@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0004_tourimportstate'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='somepilotname',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='somepilotname',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_current', True)), fields=('pilot',), name='unique_current_name_per_pilot'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0005_somepilotname_current_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='il2statsserver',
+            name='poll_interval',
+            field=models.PositiveIntegerField(default=300, help_text='Online players poll interval in seconds'),
+        ),
+    ]
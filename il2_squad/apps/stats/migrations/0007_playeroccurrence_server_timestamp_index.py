@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0006_il2statsserver_poll_interval'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='playeroccurrence',
+            index=models.Index(fields=['server', 'timestamp'], name='stats_occ_server_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0007_playeroccurrence_server_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('red_count', models.PositiveIntegerField(default=0)),
+                ('blue_count', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stats.il2statsserver')),
+            ],
+            options={
+                'verbose_name': 'Poll Snapshot',
+                'verbose_name_plural': 'Poll Snapshots',
+                'ordering': ['-timestamp', 'server'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='pollsnapshot',
+            constraint=models.UniqueConstraint(fields=('server', 'timestamp'), name='stats_pollsnapshot_server_ts_unique'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0008_pollsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopulationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('coalition', models.CharField(choices=[('blue', 'Blue'), ('red', 'Red')], max_length=10)),
+                ('resolution', models.CharField(choices=[('5m', '5 minutes'), ('1h', 'Hour'), ('1d', 'Day')], max_length=2)),
+                ('bucket', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('min_players', models.PositiveIntegerField(default=0)),
+                ('avg_players', models.FloatField(default=0)),
+                ('max_players', models.PositiveIntegerField(default=0)),
+                ('unique_pilots', models.PositiveIntegerField(default=0)),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stats.il2statsserver')),
+            ],
+            options={
+                'verbose_name': 'Population Rollup',
+                'verbose_name_plural': 'Population Rollups',
+                'ordering': ['-bucket', 'server', 'resolution', 'coalition'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='populationrollup',
+            constraint=models.UniqueConstraint(fields=('server', 'resolution', 'bucket', 'coalition'), name='stats_rollup_server_res_bucket_unique'),
+        ),
+    ]
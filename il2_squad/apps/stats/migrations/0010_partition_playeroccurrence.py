@@ -0,0 +1,109 @@
+"""
+Turn stats_playeroccurrence into a table partitioned by month of `timestamp`.
+
+PostgreSQL requires the partition key in the primary key, so the table's primary key becomes
+(id, timestamp); `id` stays unique, as it is drawn from a sequence. Existing rows are copied into
+monthly partitions; indexes and foreign keys are recreated under their previous names. The model
+state does not change.
+"""
+from datetime import datetime, timezone
+from django.db import migrations
+
+
+TABLE = "stats_playeroccurrence"
+COLUMNS = '"id", "server_id", "pilot_id", "timestamp", "coalition"'
+# Months ahead of the current one that partitions are created for; later ones come from stats.partitions
+MONTHS_AHEAD = 3
+
+
+def get_indexes_and_foreign_keys(cursor, table):
+    """
+    Get the definitions of a table's indexes (except its primary key) and foreign keys.
+    """
+    cursor.execute(
+        """
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE tablename = %s AND indexname <> %s;""", [table, f"{table}_pkey"])
+    indexes = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f';""", [table])
+    return indexes, cursor.fetchall()
+
+
+def rebuild_table(cursor, partitioned):
+    """
+    Rebuild the occurrence table as a partitioned or a plain table, keeping its rows.
+    """
+    old = f"{TABLE}_old"
+    indexes, foreign_keys = get_indexes_and_foreign_keys(cursor, TABLE)
+    cursor.execute(f'SELECT COALESCE(MAX("id"), 0) FROM "{TABLE}";')
+    max_id = cursor.fetchone()[0]
+
+    # Free all names of the old table
+    cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{old}";')
+    cursor.execute(f'ALTER TABLE "{old}" RENAME CONSTRAINT "{TABLE}_pkey" TO "{old}_pkey";')
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX "{name}";')
+    for name, _ in foreign_keys:
+        cursor.execute(f'ALTER TABLE "{old}" DROP CONSTRAINT "{name}";')
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = %s AND is_identity = 'YES';", [old])
+    if cursor.fetchone():
+        cursor.execute(f'ALTER TABLE "{old}" ALTER COLUMN "id" DROP IDENTITY;')
+    else:
+        cursor.execute(f'ALTER TABLE "{old}" ALTER COLUMN "id" DROP DEFAULT;')
+    cursor.execute(f'DROP SEQUENCE IF EXISTS "{TABLE}_id_seq";')
+
+    # New table; ids come from a sequence, identity columns aren't supported by partitioned tables
+    partition_by = ' PARTITION BY RANGE ("timestamp")' if partitioned else ""
+    primary_key = '"id", "timestamp"' if partitioned else '"id"'
+    cursor.execute(f'CREATE TABLE "{TABLE}" (LIKE "{old}" INCLUDING DEFAULTS){partition_by};')
+    cursor.execute(f'CREATE SEQUENCE "{TABLE}_id_seq" OWNED BY "{TABLE}"."id";')
+    cursor.execute(f'ALTER TABLE "{TABLE}" ALTER COLUMN "id" SET DEFAULT nextval(\'"{TABLE}_id_seq"\');')
+    cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY ({primary_key});')
+    for _, definition in indexes:
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition};')
+
+    if partitioned:
+        cursor.execute(f'CREATE TABLE "{TABLE}_default" PARTITION OF "{TABLE}" DEFAULT;')
+        cursor.execute(f'SELECT MIN("timestamp") FROM "{old}";')
+        first = cursor.fetchone()[0]
+        now = datetime.now(timezone.utc)
+        first_month = (first or now).astimezone(timezone.utc)
+        month = first_month.year * 12 + first_month.month - 1
+        last = now.year * 12 + now.month - 1 + MONTHS_AHEAD
+        while month <= last:
+            start = datetime(month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+            end = datetime((month + 1) // 12, (month + 1) % 12 + 1, 1, tzinfo=timezone.utc)
+            cursor.execute(
+                f'CREATE TABLE "{TABLE}_y{start.year:04d}m{start.month:02d}" PARTITION OF "{TABLE}" '
+                f'FOR VALUES FROM (%s) TO (%s);', [start, end])
+            month += 1
+
+    cursor.execute(f'INSERT INTO "{TABLE}" ({COLUMNS}) SELECT {COLUMNS} FROM "{old}";')
+    cursor.execute(f'SELECT setval(\'"{TABLE}_id_seq"\', %s, %s);', [max(max_id, 1), max_id > 0])
+    cursor.execute(f'DROP TABLE "{old}";')
+
+
+def partition(apps, schema_editor):
+    rebuild_table(schema_editor.connection.cursor(), partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    # The partitions are dropped along with the old partitioned table
+    rebuild_table(schema_editor.connection.cursor(), partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0009_populationrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
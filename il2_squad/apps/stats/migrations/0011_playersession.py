@@ -0,0 +1,37 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0010_partition_playeroccurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('coalition', models.CharField(choices=[('blue', 'Blue'), ('red', 'Red')], max_length=10)),
+                ('start_at', models.DateTimeField()),
+                ('end_at', models.DateTimeField()),
+                ('sample_count', models.PositiveIntegerField(default=1)),
+                ('is_open', models.BooleanField(default=True)),
+                ('pilot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stats.somepilot')),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stats.il2statsserver')),
+            ],
+            options={
+                'verbose_name': 'Player Session',
+                'verbose_name_plural': 'Player Sessions',
+                'ordering': ['-start_at', 'server', 'pilot'],
+                'indexes': [models.Index(fields=['server', 'start_at'], name='stats_session_server_start_idx'), models.Index(fields=['pilot', 'start_at'], name='stats_session_pilot_start_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='playersession',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_open', True)), fields=('server', 'pilot', 'coalition'), name='unique_open_session_per_pilot'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:47
+
+import django.contrib.postgres.constraints
+import django.db.models.deletion
+import stats.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Number of overlapping sorties listed when the constraint can't be added
+MAX_REPORTED_OVERLAPS = 50
+
+
+def check_overlaps(apps, schema_editor):
+    """
+    Make sure no stored sorties overlap, before anything is changed.
+
+    Uses the rule of the exclusion constraint (sorties touching each other overlap); of two
+    overlapping sorties, the later one is reported, like the import skips it.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT sortie_id, pilot_id FROM (
+                SELECT sortie.sortie_id, sortie.start_at, life.pilot_id,
+                       MAX(sortie.end_at) OVER (
+                           PARTITION BY life.pilot_id ORDER BY sortie.start_at, sortie.id
+                           ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS latest_end
+                FROM stats_sortie AS sortie
+                JOIN stats_virtuallife AS life ON life.id = sortie.virtual_life_id
+            ) AS sorties
+            WHERE start_at <= latest_end
+            ORDER BY pilot_id, sortie_id;""")
+        overlapping = cursor.fetchall()
+    if overlapping:
+        listed = ", ".join(f"{sortie_id} (pilot {pilot_id})" for sortie_id, pilot_id in overlapping[:MAX_REPORTED_OVERLAPS])
+        more = f" and {len(overlapping) - MAX_REPORTED_OVERLAPS} more" if len(overlapping) > MAX_REPORTED_OVERLAPS else ""
+        raise RuntimeError(
+            f"Can't add the constraint exclude_overlapping_sorties: {len(overlapping)} sorties overlap earlier "
+            f"sorties of the same pilot: {listed}{more}. Delete or correct them and migrate again.")
+
+
+def fill_pilot(apps, schema_editor):
+    """
+    Copy the pilot of each sortie's virtual life.
+    """
+    schema_editor.execute(
+        """
+        UPDATE stats_sortie SET pilot_id = life.pilot_id
+        FROM stats_virtuallife AS life
+        WHERE stats_sortie.virtual_life_id = life.id;""")
+    # Check the new foreign keys now; pending (deferred) trigger events would make the following
+    # ALTER TABLE of stats_sortie fail
+    schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0011_playersession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(check_overlaps, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='sortie',
+            name='pilot',
+            field=models.ForeignKey(null=True, editable=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(fill_pilot, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='sortie',
+            name='pilot',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='sortie',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(expressions=[(stats.models.Int8Range('pilot'), '&&'), (stats.models.TsTzRange('start_at', 'end_at'), '&&')], name='exclude_overlapping_sorties', violation_error_message='Timely overlapping sortie already exists.'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0012_sortie_pilot_exclusion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tour_id', models.IntegerField()),
+                ('category', models.CharField(choices=[('points', 'Points'), ('sortie_points', 'Sortie points'), ('air_combat_points', 'Air combat points'), ('ground_combat_points', 'Ground combat points'), ('ship_combat_points', 'Ship combat points'), ('leadership_points', 'Leadership points'), ('nco_points', 'Nco points'), ('air_kills', 'Air kills'), ('ground_kills', 'Ground kills'), ('ship_kills', 'Ship kills'), ('flight_time', 'Flight time'), ('sorties', 'Sorties')], max_length=24)),
+                ('value', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('rank', models.PositiveIntegerField()),
+                ('position', models.PositiveIntegerField()),
+                ('pilot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Leaderboard Entry',
+                'verbose_name_plural': 'Leaderboard Entries',
+                'ordering': ['tour_id', 'category', 'position'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(fields=('tour_id', 'category', 'position'), name='stats_leaderboard_position_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(fields=('tour_id', 'category', 'pilot'), name='stats_leaderboard_pilot_unique'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.14 on 2026-10-17 19:55
+
+from django.db import migrations, models
+
+
+def fill_current_name(apps, schema_editor):
+    """
+    Copy each pilot's current name.
+    """
+    schema_editor.execute(
+        """
+        UPDATE stats_somepilot SET current_name = name.name
+        FROM stats_somepilotname AS name
+        WHERE name.pilot_id = stats_somepilot.id AND name.is_current;""")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0013_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='somepilot',
+            name='current_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.RunPython(fill_current_name, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='playeroccurrence',
+            index=models.Index(fields=['timestamp'], name='stats_occ_ts_idx'),
+        ),
+    ]
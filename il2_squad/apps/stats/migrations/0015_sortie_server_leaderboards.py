@@ -0,0 +1,91 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_sortie_server(apps, schema_editor):
+    """
+    Set the server of each sortie to the one of its pilot's stats page; of several pages, the one
+    the sortie's tour was imported from wins.
+    """
+    schema_editor.execute(
+        """
+        UPDATE stats_sortie SET server_id = pages.server_id
+        FROM (
+            SELECT DISTINCT ON (sortie.id) sortie.id, page.server_id
+            FROM stats_sortie AS sortie
+            JOIN stats_pilotstatspage AS page ON page.pilot_id = sortie.pilot_id
+            LEFT JOIN stats_tourimportstate AS state
+                ON state.stats_page_id = page.id AND state.tour_id = sortie.tour_id
+            ORDER BY sortie.id, state.id IS NULL, page.id
+        ) AS pages
+        WHERE stats_sortie.id = pages.id;""")
+    # Check the new foreign keys now, see 0012
+    schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE;")
+
+
+def fill_entry_server(apps, schema_editor):
+    """
+    Set the server of the leaderboard entries from their sorties; entries of sorties without a
+    server are dropped. Tours of several servers that were merged are split by build_leaderboards.
+    """
+    schema_editor.execute(
+        """
+        UPDATE stats_leaderboardentry SET server_id = sorties.server_id
+        FROM (
+            SELECT pilot_id, tour_id, MIN(server_id) AS server_id
+            FROM stats_sortie
+            GROUP BY pilot_id, tour_id
+        ) AS sorties
+        WHERE stats_leaderboardentry.pilot_id = sorties.pilot_id
+          AND stats_leaderboardentry.tour_id = sorties.tour_id;""")
+    schema_editor.execute("DELETE FROM stats_leaderboardentry WHERE server_id IS NULL;")
+    schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0014_somepilot_current_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sortie',
+            name='server',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='stats.il2statsserver'),
+        ),
+        migrations.RunPython(fill_sortie_server, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='leaderboardentry',
+            name='stats_leaderboard_position_unique',
+        ),
+        migrations.RemoveConstraint(
+            model_name='leaderboardentry',
+            name='stats_leaderboard_pilot_unique',
+        ),
+        migrations.AddField(
+            model_name='leaderboardentry',
+            name='server',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='stats.il2statsserver'),
+        ),
+        migrations.RunPython(fill_entry_server, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='leaderboardentry',
+            name='server',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stats.il2statsserver'),
+        ),
+        migrations.AlterModelOptions(
+            name='leaderboardentry',
+            options={'ordering': ['server', 'tour_id', 'category', 'position'], 'verbose_name': 'Leaderboard Entry', 'verbose_name_plural': 'Leaderboard Entries'},
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(fields=('server', 'tour_id', 'category', 'position'), name='stats_leaderboard_position_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(fields=('server', 'tour_id', 'category', 'pilot'), name='stats_leaderboard_pilot_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0015_sortie_server_leaderboards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sortie',
+            name='site_points',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=6),
+        ),
+    ]
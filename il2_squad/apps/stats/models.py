@@ -1,6 +1,13 @@
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import BigIntegerRangeField, DateTimeRangeField, RangeBoundary, RangeOperators
+from django.db import connection, models, transaction
 from django.contrib.auth.models import User
+from .caching import (
+    get_generation, get_or_set, get_pilot_names, invalidate_pilot_names, invalidate_player_cnts,
+    leaderboard_key, player_cnt_key, server_generation_key, tour_generation_key,
+    LEADERBOARD_CACHE_TTL, PLAYER_CNT_CACHE_TTL,
+)
 from .scrapers import SCRAPER_OPTIONS, DEFAULT_SCRAPER_IDENTIFIER
 from django.utils.translation import gettext_lazy as _
 from urllib.parse import urlparse
@@ -17,6 +24,13 @@ COALITION_CHOICES = (
 )
 
 
+# Point fields of ModelWithPoints
+POINTS_FIELDS = (
+    "sortie_points", "air_combat_points", "ground_combat_points", "ship_combat_points",
+    "leadership_points", "nco_points",
+)
+
+
 class ModelWithPoints(models.Model):
     """
     Abstract base class for models that store combat points.
@@ -49,6 +63,8 @@ class IL2StatsServer(models.Model):
     url = models.URLField()
     scraper_type = models.CharField(max_length=50, choices=SCRAPER_OPTIONS, 
                                     default=DEFAULT_SCRAPER_IDENTIFIER)
+    # How often the poller (poll_online_players) fetches the server's online page
+    poll_interval = models.PositiveIntegerField(default=300, help_text=_("Online players poll interval in seconds"))
 
     class Meta:
         verbose_name = "IL-2 Stats Server"
@@ -90,6 +106,50 @@ class PilotStatsPage(models.Model):
         return f"{self.pilot.username} - {self.server.name}"
 
 
+class TourImportState(models.Model):
+    """
+    Import progress (high-water mark) of a pilot's stats page for one tour.
+
+    This allows incremental imports: sortie lists are only walked until the last
+    imported sortie, and closed tours that were imported completely are skipped.
+    """
+    stats_page = models.ForeignKey(PilotStatsPage, on_delete=models.CASCADE)
+    tour_id = models.IntegerField()
+    # Highest sortie ID imported for this tour
+    last_sortie_id = models.IntegerField(default=0)
+    # Set once the tour is closed and all its sorties have been imported
+    is_complete = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Tour Import State")
+        verbose_name_plural = _("Tour Import States")
+        unique_together = ["stats_page", "tour_id"]
+
+    @classmethod
+    def record(cls, stats_page, tour_id, last_sortie_id, is_complete=False):
+        """
+        Record the import progress of a tour; the high-water mark never moves backwards.
+
+        @param stats_page: PilotStatsPage object
+        @param tour_id: ID of the tour on the stats site
+        @param last_sortie_id: highest sortie ID seen in this import
+        @param is_complete: whether the tour is closed and fully imported
+        """
+        state, created = cls.objects.get_or_create(
+            stats_page=stats_page, tour_id=tour_id,
+            defaults={"last_sortie_id": last_sortie_id, "is_complete": is_complete},
+        )
+        if not created:
+            state.last_sortie_id = max(state.last_sortie_id, last_sortie_id)
+            state.is_complete = state.is_complete or is_complete
+            state.save()
+        return state
+
+    def __str__(self):
+        return f"{self.stats_page} - tour {self.tour_id}"
+
+
 class VirtualLife(ModelWithPoints):
     """
     Model for a pilot's virtual life.
@@ -129,11 +189,38 @@ class Aircraft(models.Model):
         return self.name
 
 
+class TsTzRange(models.Func):
+    """
+    Closed timestamp range of two fields.
+    """
+    function = "TSTZRANGE"
+    output_field = DateTimeRangeField()
+
+    def __init__(self, lower, upper, **extra):
+        super().__init__(lower, upper, RangeBoundary(inclusive_lower=True, inclusive_upper=True), **extra)
+
+
+class Int8Range(models.Func):
+    """
+    Closed integer range of a single field's value; overlaps another one only if the values are equal.
+    """
+    function = "INT8RANGE"
+    output_field = BigIntegerRangeField()
+
+    def __init__(self, field, **extra):
+        super().__init__(field, field, RangeBoundary(inclusive_lower=True, inclusive_upper=True), **extra)
+
+
 class Sortie(ModelWithPoints):
     """
     Model for a pilot's sortie.
     """
     virtual_life = models.ForeignKey(VirtualLife, on_delete=models.CASCADE)
+    # Same as virtual_life.pilot; needed on this table for the overlap constraint
+    pilot = models.ForeignKey(User, on_delete=models.CASCADE, editable=False)
+    # Server the sortie was imported from; tour IDs are per server. Only unknown for sorties stored
+    # before this was recorded, of pilots without a stats page.
+    server = models.ForeignKey(IL2StatsServer, on_delete=models.CASCADE, null=True, editable=False)
     aircraft = models.ForeignKey(Aircraft, on_delete=models.CASCADE)
     start_at = models.DateTimeField()
     end_at = models.DateTimeField()
@@ -145,18 +232,64 @@ class Sortie(ModelWithPoints):
     # Tour and sortie ID are taken from the scraped site (il2stats)
     tour_id = models.IntegerField(default=0)
     sortie_id = models.IntegerField(default=0, unique=True)
+    # Score awarded by the scraped site; the point fields are scored from it and the other stats
+    site_points = models.DecimalField(decimal_places=2, max_digits=6, default=0, editable=False)
 
     def clean(self):
         # Ensure that there are no overlapping sorties for the same pilot.
+        self.pilot_id = self.virtual_life.pilot_id
         if Sortie.objects.filter(
-            virtual_life__pilot=self.virtual_life.pilot,
+            pilot_id=self.pilot_id,
             start_at__lte=self.end_at,
             end_at__gte=self.start_at,
-        ).exists():
+        ).exclude(pk=self.pk).exists():
             raise ValidationError(_("Timely overlapping sortie already exists."))
 
+    def save(self, *args, **kwargs):
+        self.pilot_id = self.virtual_life.pilot_id
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def find_overlapping(cls, pilot_id, intervals):
+        """
+        Find intervals that overlap stored sorties of a pilot, in one query.
+
+        Uses the same rule as clean(): intervals touching a sortie count as overlapping. The query
+        is answered from the GiST index of the exclusion constraint.
+
+        @param pilot_id: ID of the pilot (User)
+        @param intervals: list of (key, start_at, end_at) tuples; keys are integers, e.g. sortie IDs
+        @return: set of keys of the overlapping intervals
+        """
+        if not intervals:
+            return set()
+        keys, starts, ends = zip(*intervals)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT batch.key
+                FROM unnest(%s::bigint[], %s::timestamptz[], %s::timestamptz[]) AS batch(key, start_at, end_at)
+                WHERE EXISTS (
+                    SELECT 1 FROM stats_sortie AS sortie
+                    WHERE INT8RANGE(sortie.pilot_id, sortie.pilot_id, '[]') && INT8RANGE(%s, %s, '[]')
+                      AND TSTZRANGE(sortie.start_at, sortie.end_at, '[]')
+                          && TSTZRANGE(batch.start_at, batch.end_at, '[]')
+                );""", [list(keys), list(starts), list(ends), pilot_id, pilot_id])
+            return {row[0] for row in cursor.fetchall()}
+
     class Meta:
         ordering = ["virtual_life", "start_at"]
+        constraints = [
+            # No two sorties of a pilot may overlap or touch; also enforced for bulk inserts
+            ExclusionConstraint(
+                name="exclude_overlapping_sorties",
+                expressions=[
+                    (Int8Range("pilot"), RangeOperators.OVERLAPS),
+                    (TsTzRange("start_at", "end_at"), RangeOperators.OVERLAPS),
+                ],
+                violation_error_message=_("Timely overlapping sortie already exists."),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.virtual_life.pilot.username} - {self.start_at}"
@@ -177,6 +310,8 @@ class SomePilot(models.Model):
     blue_occ_count = models.IntegerField(default=0, help_text=_("Number of times this pilot has been seen on the blue side"))
     # If the pilot is a member of this squad, we can link him to a user account
     squad_pilot = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # Copy of the current SomePilotName's name, kept in sync by SomePilotName; saves a query per pilot in lists
+    current_name = models.CharField(max_length=100, blank=True, default="", editable=False)
     
     class Meta:
         verbose_name = _("Some Pilot")
@@ -192,23 +327,8 @@ class SomePilot(models.Model):
         @param name: the name to set as current
         @param url: pilot's URL on the site
         """
-        current = self.somepilotname_set.filter(is_current=True).first()
-        if current and current.name == name:
-            current.last_seen=timezone.now()
-            current.save()
-            return
-          
-        name_rec = SomePilotName.objects.filter(name=name, pilot=self).first()
-        if name_rec:
-            name_rec.set_current()
-        else:
-            SomePilotName.objects.create(
-                name=name,
-                pilot=self,
-                first_seen=timezone.now(),
-                last_seen=timezone.now(),
-                url=url
-            )
+        if SomePilotName.track_names([(self.id_on_site, name, url)], pilot_ids={self.id_on_site: self.id}):
+            self.current_name = name
         
     def name(self):
         """
@@ -216,7 +336,18 @@ class SomePilot(models.Model):
         
         @return: the current name of this pilot
         """
-        return self.somepilotname_set.filter(is_current=True).first().name
+        return self.current_name
+
+    @classmethod
+    def names(cls, pilot_ids):
+        """
+        Get the current names of pilots by their IDs; cached until they are renamed.
+
+        @param pilot_ids: iterable of SomePilot IDs
+        @return: dict pilot ID -> current name; unknown IDs are missing
+        """
+        return get_pilot_names(pilot_ids, lambda missing: dict(
+            cls.objects.filter(id__in=missing).values_list("id", "current_name")))
         
     def __str__(self):
         return f'{self.id_on_site}'
@@ -246,8 +377,11 @@ class SomePilotName(models.Model):
         verbose_name = _("Some pilot's name")
         verbose_name_plural = _("Some pilot names")
         ordering = ["-last_seen", "name"]
-        # Only one current name per pilot
-        unique_together = ["is_current", "pilot"]
+        constraints = [
+            # Only one current name per pilot; any number of former names
+            models.UniqueConstraint(fields=["pilot"], condition=models.Q(is_current=True),
+                                    name="unique_current_name_per_pilot"),
+        ]
         
     def set_current(self):
         """
@@ -263,12 +397,121 @@ class SomePilotName(models.Model):
             # Set this name as current
             self.is_current = True
             self.last_seen = timezone.now()
+            SomePilot.objects.filter(id=self.pilot_id).update(current_name=self.name)
+            transaction.on_commit(lambda: invalidate_pilot_names([self.pilot_id]))
         self.save()
+
+    @classmethod
+    def track_names(cls, entries, timestamp=None, pilot_ids=None):
+        """
+        Track the names of a whole poll of pilots in a few set based statements.
+
+        Unchanged names get their `last_seen` bumped, renamed pilots switch their current name
+        (to a former name or a new one), new names are inserted. The renamed pilots' `current_name`
+        is updated in one statement, and their cached names are dropped once committed.
+
+        @param entries: iterable of (id_on_site, name, url) tuples
+        @param timestamp: time the names were seen; defaults to now
+        @param pilot_ids: optional dict mapping id_on_site to SomePilot IDs, saves a query
+        @return: list of (pilot ID, name) tuples of pilots whose current name changed
+        """
+        timestamp = timestamp or timezone.now()
+        # One entry per pilot
+        entries = {id_on_site: (name, url) for id_on_site, name, url in entries}
+        if not entries:
+            return []
+        if pilot_ids is None:
+            pilot_ids = dict(SomePilot.objects.filter(id_on_site__in=entries).values_list("id_on_site", "id"))
+        wanted = {pilot_ids[id_on_site]: name_url for id_on_site, name_url in entries.items() if id_on_site in pilot_ids}
+
+        # Current names and former names that may become current again
+        current = {}
+        former = {}
+        for name_id, pilot_id, name, is_current in cls.objects.filter(
+            models.Q(is_current=True) | models.Q(name__in={name for name, _ in wanted.values()}),
+            pilot_id__in=wanted,
+        ).order_by().values_list("id", "pilot_id", "name", "is_current"):
+            if is_current:
+                current[pilot_id] = (name_id, name)
+            else:
+                former[(pilot_id, name)] = name_id
+
+        seen = []
+        cleared = []
+        new_names = []
+        renamed = []
+        for pilot_id, (name, url) in wanted.items():
+            current_id, current_name = current.get(pilot_id, (None, None))
+            if current_name == name:
+                seen.append(current_id)
+                continue
+            renamed.append((pilot_id, name))
+            if current_id is not None:
+                cleared.append(current_id)
+            if (pilot_id, name) in former:
+                seen.append(former[(pilot_id, name)])
+            else:
+                new_names.append(cls(name=name, pilot_id=pilot_id, first_seen=timestamp, last_seen=timestamp,
+                                     url=url, is_current=True))
+
+        # Clear old current names first, so there is never more than one current name per pilot
+        if cleared:
+            cls.objects.filter(id__in=cleared).update(is_current=False)
+        if seen:
+            cls.objects.filter(id__in=seen).update(is_current=True, last_seen=timestamp)
+        if new_names:
+            cls.objects.bulk_create(new_names)
+        if renamed:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    UPDATE stats_somepilot AS pilot SET current_name = renamed.name
+                    FROM unnest(%s::bigint[], %s::varchar[]) AS renamed(id, name)
+                    WHERE pilot.id = renamed.id;""",
+                    [[pilot_id for pilot_id, _ in renamed], [name for _, name in renamed]])
+            transaction.on_commit(lambda: invalidate_pilot_names([pilot_id for pilot_id, _ in renamed]))
+        return renamed
         
     def __str__(self):
         return self.name
     
     
+class PlayerOccurrenceQuerySet(models.QuerySet):
+    """
+    QuerySet of PlayerOccurrence objects.
+    """
+
+    def datetimes(self, field_name, kind, order="ASC", tzinfo=None):
+        """
+        Get the distinct years, months or days of the occurrences' timestamps.
+
+        Instead of truncating the timestamp of every row (a scan of the whole table), this skips
+        from one year/month/day to the next, with one index seek (MIN(timestamp)) per result. Used
+        by the admin's date hierarchy. Other fields and kinds are passed to QuerySet.datetimes().
+
+        @return: list of aware datetimes, the starts of the years/months/days
+        """
+        if field_name != "timestamp" or kind not in ("year", "month", "day"):
+            return super().datetimes(field_name, kind, order, tzinfo)
+        tzinfo = tzinfo or timezone.get_current_timezone()
+        queryset = self.order_by()
+        result = []
+        first = queryset.aggregate(first=models.Min("timestamp"))["first"]
+        while first is not None:
+            first = first.astimezone(tzinfo)
+            start = first.replace(month=1 if kind == "year" else first.month, day=first.day if kind == "day" else 1,
+                                  hour=0, minute=0, second=0, microsecond=0)
+            if kind == "year":
+                end = start.replace(year=start.year + 1)
+            elif kind == "month":
+                end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+            else:
+                end = start + timezone.timedelta(days=1)
+            result.append(start)
+            first = queryset.filter(timestamp__gte=end).aggregate(first=models.Min("timestamp"))["first"]
+        return result if order == "ASC" else result[::-1]
+
+
 class PlayerOccurrence(models.Model):
     """
     Model that stores an occurrence of a player on a server.
@@ -281,11 +524,19 @@ class PlayerOccurrence(models.Model):
     pilot = models.ForeignKey(SomePilot, on_delete=models.CASCADE)
     timestamp = models.DateTimeField(auto_created=True)
     coalition = models.CharField(max_length=10, choices=COALITION_CHOICES)
+
+    objects = PlayerOccurrenceQuerySet.as_manager()
     
     class Meta:
         verbose_name = _("Player Occurrence")
         verbose_name_plural = _("Player Occurrences")
         ordering = ["-timestamp", "server", "pilot"]
+        indexes = [
+            # Nearest sample lookups (closest_timestamp) and time bounded queries per server
+            models.Index(fields=["server", "timestamp"], name="stats_occ_server_ts_idx"),
+            # MIN/MAX and range scans over all servers, e.g. the admin's date hierarchy
+            models.Index(fields=["timestamp"], name="stats_occ_ts_idx"),
+        ]
 
     @classmethod
     def closest_timestamp(cls, server, timestamp):
@@ -298,17 +549,26 @@ class PlayerOccurrence(models.Model):
         @param timestamp: the timestamp to compare
         @return: the closest timestamp
         """
-        # Get sample with timestamp closest to the given timestamp
-        samples = PlayerOccurrence.objects.raw(
-            """
-            SELECT *, ABS(EXTRACT(EPOCH FROM (timestamp - %s))) AS diff
-            FROM stats_playeroccurrence
-            WHERE server_id = %s
-            ORDER BY diff
-            LIMIT 1;""", [timestamp, server.id])
-        if not len(samples):
+        # Nearest sample at or before and nearest sample after the timestamp; each of them is a
+        # single seek on the (server, timestamp) index, no matter how many samples there are.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT timestamp FROM (
+                    (SELECT timestamp FROM stats_playeroccurrence
+                     WHERE server_id = %s AND timestamp <= %s
+                     ORDER BY timestamp DESC LIMIT 1)
+                    UNION ALL
+                    (SELECT timestamp FROM stats_playeroccurrence
+                     WHERE server_id = %s AND timestamp > %s
+                     ORDER BY timestamp ASC LIMIT 1)
+                ) AS candidates
+                ORDER BY ABS(EXTRACT(EPOCH FROM (timestamp - %s))), timestamp
+                LIMIT 1;""", [server.id, timestamp, server.id, timestamp, timestamp])
+            row = cursor.fetchone()
+        if row is None:
             return None
-        return samples[0].timestamp
+        return row[0]
 
     @classmethod
     def player_cnt_at(cls, server, timestamp):
@@ -318,31 +578,506 @@ class PlayerOccurrence(models.Model):
         This is not 100% accurate, as we only poll/sample players at a given time. So this function
         returns the number of players sample taken closest to the given timestamp.
 
-        Uses raw SQL to optimize speed.
+        Reads the poll's PollSnapshot, so this is a single row lookup; results are cached until the
+        next poll of the server is stored.
 
         @param server: the server to check
         @param timestamp: the timestamp to check
         @return: None if no samples could be found;
                  dict with the number of players on the server at the given timestamp for each coalition
         """
+        def compute():
+            snapshot = PollSnapshot.closest(server, timestamp)
+            if snapshot is None:
+                return None
 
-        ts = cls.closest_timestamp(server, timestamp)
-        if not ts:
-            return None
+            # If the sample is off by more than a certain delta, ignore it
+            if abs(snapshot.timestamp - timestamp) > cls.max_delta():
+                return None
 
-        # If the sample is off by more than a certain delta, ignore it
-        if abs(ts - timestamp) > timezone.timedelta(minutes=getattr(settings, "PLAYER_OCCURRENCE_MAX_DELTA_MINUTES", 60)):
-            return None
+            return {COALITION_RED: snapshot.red_count, COALITION_BLUE: snapshot.blue_count}
+
+        generation = get_generation(server_generation_key(server.id))
+        return get_or_set(player_cnt_key(server.id, generation, timestamp), compute, PLAYER_CNT_CACHE_TTL)
+
+    @classmethod
+    def player_cnts_at(cls, server, timestamps):
+        """
+        Get the number of players on the server at each of the given timestamps.
 
-        red_cnt = PlayerOccurrence.objects.filter(
-            server=server, coalition=COALITION_RED, timestamp=ts
-        ).count()
-        blue_cnt = PlayerOccurrence.objects.filter(
-            server=server, coalition=COALITION_BLUE, timestamp=ts
-        ).count()
-        return {COALITION_RED: red_cnt, COALITION_BLUE: blue_cnt}
+        Batch version of player_cnt_at, with the same results, in a single query.
+
+        @param server: the server to check
+        @param timestamps: iterable of timestamps to check
+        @return: list with an entry per timestamp, in the same order; each is None if no sample
+                 could be found, or a dict with the number of players for each coalition
+        """
+        timestamps = list(timestamps)
+        max_delta = cls.max_delta()
+        counts = []
+        for timestamp, snapshot in zip(timestamps, PollSnapshot.closest_many(server, timestamps)):
+            if snapshot is None or abs(snapshot[0] - timestamp) > max_delta:
+                counts.append(None)
+            else:
+                counts.append({COALITION_RED: snapshot[1], COALITION_BLUE: snapshot[2]})
+        return counts
+
+    @staticmethod
+    def max_delta():
+        """
+        Get the maximum distance between a timestamp and the sample used for it.
+        """
+        return timezone.timedelta(minutes=getattr(settings, "PLAYER_OCCURRENCE_MAX_DELTA_MINUTES", 60))
 
     def __str__(self):
         return f"{self.pilot} on {self.server} at {self.timestamp}"
 
 
+class PollSnapshot(models.Model):
+    """
+    Model that stores the player counts of one poll of a server's online players.
+
+    Written together with the poll's PlayerOccurrence objects, so player counts can be read from a
+    single row instead of counting occurrences.
+    """
+    server = models.ForeignKey(IL2StatsServer, on_delete=models.CASCADE)
+    timestamp = models.DateTimeField()
+    red_count = models.PositiveIntegerField(default=0)
+    blue_count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Poll Snapshot")
+        verbose_name_plural = _("Poll Snapshots")
+        ordering = ["-timestamp", "server"]
+        constraints = [
+            # Also the index for nearest snapshot lookups
+            models.UniqueConstraint(fields=["server", "timestamp"], name="stats_pollsnapshot_server_ts_unique"),
+        ]
+
+    @classmethod
+    def record(cls, server, timestamp, red_count, blue_count):
+        """
+        Store the player counts of a poll; recording the same poll again overwrites its counts.
+
+        @return: PollSnapshot object
+        """
+        # A single upsert, no matter whether the poll was recorded before
+        snapshot = cls(server=server, timestamp=timestamp, red_count=red_count, blue_count=blue_count,
+                       total=red_count + blue_count)
+        cls.objects.bulk_create(
+            [snapshot], update_conflicts=True, unique_fields=["server", "timestamp"],
+            update_fields=["red_count", "blue_count", "total"],
+        )
+        return snapshot
+
+    @classmethod
+    def closest(cls, server, timestamp):
+        """
+        Get the snapshot closest to the given timestamp.
+
+        @param server: the server to check
+        @param timestamp: the timestamp to compare
+        @return: PollSnapshot object or None if the server has no snapshots
+        """
+        # Same two index seeks as PlayerOccurrence.closest_timestamp, on the much smaller snapshot table
+        snapshots = cls.objects.raw(
+            """
+            SELECT * FROM (
+                (SELECT * FROM stats_pollsnapshot
+                 WHERE server_id = %s AND timestamp <= %s
+                 ORDER BY timestamp DESC LIMIT 1)
+                UNION ALL
+                (SELECT * FROM stats_pollsnapshot
+                 WHERE server_id = %s AND timestamp > %s
+                 ORDER BY timestamp ASC LIMIT 1)
+            ) AS candidates
+            ORDER BY ABS(EXTRACT(EPOCH FROM (timestamp - %s))), timestamp
+            LIMIT 1;""", [server.id, timestamp, server.id, timestamp, timestamp])
+        for snapshot in snapshots:
+            return snapshot
+        return None
+
+    @classmethod
+    def closest_many(cls, server, timestamps):
+        """
+        Get the snapshots closest to each of the given timestamps in one query.
+
+        @param server: the server to check
+        @param timestamps: list of timestamps to compare
+        @return: list with an entry per timestamp, in the same order; each is None if the server
+                 has no snapshots, or a tuple (timestamp, red_count, blue_count) of the closest one
+        """
+        if not timestamps:
+            return []
+        # The two index seeks of closest() for every timestamp, joined laterally
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT wanted.position, closest.timestamp, closest.red_count, closest.blue_count
+                FROM unnest(%s::timestamptz[]) WITH ORDINALITY AS wanted(timestamp, position)
+                CROSS JOIN LATERAL (
+                    SELECT * FROM (
+                        (SELECT timestamp, red_count, blue_count FROM stats_pollsnapshot
+                         WHERE server_id = %s AND timestamp <= wanted.timestamp
+                         ORDER BY timestamp DESC LIMIT 1)
+                        UNION ALL
+                        (SELECT timestamp, red_count, blue_count FROM stats_pollsnapshot
+                         WHERE server_id = %s AND timestamp > wanted.timestamp
+                         ORDER BY timestamp ASC LIMIT 1)
+                    ) AS candidates
+                    ORDER BY ABS(EXTRACT(EPOCH FROM (candidates.timestamp - wanted.timestamp))), candidates.timestamp
+                    LIMIT 1
+                ) AS closest;""", [list(timestamps), server.id, server.id])
+            rows = cursor.fetchall()
+        snapshots = [None] * len(timestamps)
+        for position, timestamp, red_count, blue_count in rows:
+            snapshots[position - 1] = (timestamp, red_count, blue_count)
+        return snapshots
+
+    @classmethod
+    def backfill(cls, server=None):
+        """
+        Build snapshots from the stored PlayerOccurrence objects; existing snapshots are recounted.
+
+        @param server: IL2StatsServer object; if None, snapshots of all servers are built
+        @return: number of snapshots written
+        """
+        where = "WHERE server_id = %s" if server is not None else ""
+        params = [COALITION_RED, COALITION_BLUE] + ([server.id] if server is not None else [])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO stats_pollsnapshot (server_id, timestamp, red_count, blue_count, total)
+                SELECT server_id, timestamp,
+                       COUNT(*) FILTER (WHERE coalition = %s),
+                       COUNT(*) FILTER (WHERE coalition = %s),
+                       COUNT(*)
+                FROM stats_playeroccurrence
+                {where}
+                GROUP BY server_id, timestamp
+                ON CONFLICT (server_id, timestamp) DO UPDATE
+                SET red_count = EXCLUDED.red_count, blue_count = EXCLUDED.blue_count, total = EXCLUDED.total;""",
+                params)
+            count = cursor.rowcount
+        servers = [server] if server is not None else IL2StatsServer.objects.all()
+        for backfilled in servers:
+            transaction.on_commit(lambda server_id=backfilled.id: invalidate_player_cnts(server_id))
+        return count
+
+    def __str__(self):
+        return f"{self.total} players on {self.server} at {self.timestamp}"
+
+
+# Sessions of a server are split when polls are missing for more than this many poll intervals
+ONLINE_SESSION_MAX_GAP_POLLS = getattr(settings, "ONLINE_SESSION_MAX_GAP_POLLS", 3)
+
+
+class PlayerSession(models.Model):
+    """
+    Model that stores an interval a pilot was continuously online on a server, on one side.
+
+    Derived from the polls: a session starts with the first poll a pilot is seen in, is extended by
+    every following poll the pilot is still in and is closed by the first poll the pilot is missing
+    from. Polls before start_at and after end_at are not known to include the pilot.
+    """
+    server = models.ForeignKey(IL2StatsServer, on_delete=models.CASCADE)
+    pilot = models.ForeignKey(SomePilot, on_delete=models.CASCADE)
+    coalition = models.CharField(max_length=10, choices=COALITION_CHOICES)
+    # Times of the first and the last poll the pilot was seen in
+    start_at = models.DateTimeField()
+    end_at = models.DateTimeField()
+    # Number of polls the pilot was seen in
+    sample_count = models.PositiveIntegerField(default=1)
+    # Whether the pilot was in the server's latest poll, i.e. the session may still be extended
+    is_open = models.BooleanField(default=True)
+
+    class Meta:
+        verbose_name = _("Player Session")
+        verbose_name_plural = _("Player Sessions")
+        ordering = ["-start_at", "server", "pilot"]
+        indexes = [
+            models.Index(fields=["server", "start_at"], name="stats_session_server_start_idx"),
+            models.Index(fields=["pilot", "start_at"], name="stats_session_pilot_start_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["server", "pilot", "coalition"], condition=models.Q(is_open=True),
+                                    name="unique_open_session_per_pilot"),
+        ]
+
+    @staticmethod
+    def max_gap(server):
+        """
+        Get the longest time between two polls of a server that doesn't split a session.
+        """
+        return timezone.timedelta(seconds=ONLINE_SESSION_MAX_GAP_POLLS * max(1, server.poll_interval))
+
+    @classmethod
+    def track(cls, server, entries, timestamp):
+        """
+        Extend, close and open the sessions of a server for a poll, in two statements.
+
+        @param server: IL2StatsServer object
+        @param entries: iterable of (pilot ID, coalition) tuples of all pilots in the poll
+        @param timestamp: time of the poll
+        @return: list of newly opened PlayerSession objects
+        """
+        entries = set(entries)
+        pilot_ids = [pilot_id for pilot_id, _ in entries]
+        coalitions = [coalition for _, coalition in entries]
+        # Open sessions of pilots in the poll are extended, all others closed; a poll after a long
+        # gap closes all sessions
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE stats_playersession AS session
+                SET is_open = seen.extend,
+                    end_at = CASE WHEN seen.extend THEN %(timestamp)s ELSE session.end_at END,
+                    sample_count = session.sample_count + seen.extend::int
+                FROM (
+                    SELECT id,
+                           (pilot_id, coalition) IN (SELECT * FROM unnest(%(pilot_ids)s::bigint[], %(coalitions)s::varchar[]))
+                           AND %(timestamp)s - end_at <= %(max_gap)s AS extend
+                    FROM stats_playersession
+                    WHERE server_id = %(server_id)s AND is_open
+                ) AS seen
+                WHERE session.id = seen.id
+                RETURNING session.pilot_id, session.coalition, seen.extend;""",
+                {"timestamp": timestamp, "pilot_ids": pilot_ids, "coalitions": coalitions,
+                 "max_gap": cls.max_gap(server), "server_id": server.id})
+            extended = {(pilot_id, coalition) for pilot_id, coalition, extend in cursor.fetchall() if extend}
+
+        new_sessions = [
+            cls(server=server, pilot_id=pilot_id, coalition=coalition, start_at=timestamp, end_at=timestamp)
+            for pilot_id, coalition in sorted(entries - extended)
+        ]
+        if new_sessions:
+            cls.objects.bulk_create(new_sessions)
+        return new_sessions
+
+    @classmethod
+    def compact(cls, server):
+        """
+        Build the sessions of a server's PlayerOccurrence history in one statement.
+
+        Only occurrences before the server's first session are converted, so this can run next to
+        the poller and be repeated. If the server has no sessions yet, the sessions of pilots in its
+        latest poll stay open, so the next poll extends them.
+
+        @param server: IL2StatsServer object
+        @return: number of created sessions
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Keep the poller from opening sessions meanwhile
+            cursor.execute("LOCK TABLE stats_playersession IN SHARE ROW EXCLUSIVE MODE;")
+            first = cls.objects.filter(server=server).order_by("start_at").values_list("start_at", flat=True).first()
+            # Polls are numbered, so a pilot missing from a poll splits the session, like live tracking does
+            cursor.execute(
+                """
+                INSERT INTO stats_playersession
+                    (server_id, pilot_id, coalition, start_at, end_at, sample_count, is_open)
+                SELECT server_id, pilot_id, coalition, MIN(timestamp), MAX(timestamp), COUNT(*),
+                       %(open)s AND MAX(timestamp) = MAX(MAX(timestamp)) OVER ()
+                FROM (
+                    SELECT *, SUM(is_new) OVER (PARTITION BY pilot_id, coalition ORDER BY timestamp) AS session
+                    FROM (
+                        SELECT server_id, pilot_id, coalition, timestamp,
+                               CASE WHEN LAG(poll) OVER pilot_polls = poll - 1
+                                         AND timestamp - LAG(timestamp) OVER pilot_polls <= %(max_gap)s
+                                    THEN 0 ELSE 1 END AS is_new
+                        FROM (
+                            SELECT server_id, pilot_id, coalition, timestamp,
+                                   DENSE_RANK() OVER (ORDER BY timestamp) AS poll
+                            FROM stats_playeroccurrence
+                            WHERE server_id = %(server_id)s AND (%(until)s::timestamptz IS NULL OR timestamp < %(until)s)
+                        ) AS polls
+                        WINDOW pilot_polls AS (PARTITION BY pilot_id, coalition ORDER BY timestamp)
+                    ) AS flagged
+                ) AS numbered
+                GROUP BY server_id, pilot_id, coalition, session;""",
+                {"open": first is None, "max_gap": cls.max_gap(server), "server_id": server.id, "until": first})
+            return cursor.rowcount
+
+    @classmethod
+    def online_at(cls, server, timestamp):
+        """
+        Get the sessions of a server that include the given timestamp.
+
+        @return: QuerySet of PlayerSession objects
+        """
+        return cls.objects.filter(server=server, start_at__lte=timestamp, end_at__gte=timestamp)
+
+    @classmethod
+    def overlapping(cls, pilot, start_at, end_at):
+        """
+        Get the sessions of a pilot overlapping a time range, e.g. a sortie.
+
+        @return: QuerySet of PlayerSession objects
+        """
+        return cls.objects.filter(pilot=pilot, start_at__lte=end_at, end_at__gte=start_at)
+
+    @classmethod
+    def online_time(cls, pilot, server=None):
+        """
+        Get the total time a pilot was online.
+
+        @param pilot: SomePilot object
+        @param server: only count sessions on this server, if given
+        @return: timedelta
+        """
+        sessions = cls.objects.filter(pilot=pilot)
+        if server is not None:
+            sessions = sessions.filter(server=server)
+        total = sessions.aggregate(total=models.Sum(models.F("end_at") - models.F("start_at")))["total"]
+        return total or timezone.timedelta(0)
+
+    def __str__(self):
+        return f"{self.pilot} on {self.server} from {self.start_at} to {self.end_at}"
+
+
+# Rollup resolutions of PopulationRollup; value: width of a bucket in seconds
+RESOLUTION_5_MINUTES = "5m"
+RESOLUTION_HOUR = "1h"
+RESOLUTION_DAY = "1d"
+RESOLUTION_CHOICES = (
+    (RESOLUTION_5_MINUTES, "5 minutes"),
+    (RESOLUTION_HOUR, "Hour"),
+    (RESOLUTION_DAY, "Day"),
+)
+RESOLUTION_SECONDS = {
+    RESOLUTION_5_MINUTES: 5 * 60,
+    RESOLUTION_HOUR: 60 * 60,
+    RESOLUTION_DAY: 24 * 60 * 60,
+}
+
+
+class PopulationRollup(models.Model):
+    """
+    Model that stores aggregated player counts of a server's coalition over a time bucket.
+
+    Buckets are aligned to the epoch (UTC) and kept at several resolutions, so population charts
+    over long ranges never have to read PlayerOccurrence objects. Maintained by stats.rollups.
+    """
+    server = models.ForeignKey(IL2StatsServer, on_delete=models.CASCADE)
+    coalition = models.CharField(max_length=10, choices=COALITION_CHOICES)
+    resolution = models.CharField(max_length=2, choices=RESOLUTION_CHOICES)
+    # Start of the bucket
+    bucket = models.DateTimeField()
+    # Number of polls in the bucket
+    samples = models.PositiveIntegerField(default=0)
+    min_players = models.PositiveIntegerField(default=0)
+    avg_players = models.FloatField(default=0)
+    max_players = models.PositiveIntegerField(default=0)
+    # Number of distinct pilots seen in the bucket
+    unique_pilots = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Population Rollup")
+        verbose_name_plural = _("Population Rollups")
+        ordering = ["-bucket", "server", "resolution", "coalition"]
+        constraints = [
+            # Also the index for range queries of a server's series
+            models.UniqueConstraint(fields=["server", "resolution", "bucket", "coalition"],
+                                    name="stats_rollup_server_res_bucket_unique"),
+        ]
+
+    @classmethod
+    def series(cls, server, start, end, resolution=None):
+        """
+        Get the rollups of a server in a time range.
+
+        @param server: the server to get the rollups of
+        @param start: start of the range; the bucket containing it is included
+        @param end: end of the range (exclusive)
+        @param resolution: one of RESOLUTION_CHOICES; if None, the finest resolution giving at most
+                           a few hundred buckets for the range is used
+        @return: QuerySet of PopulationRollup objects, oldest first
+        """
+        if resolution is None:
+            span = (end - start).total_seconds()
+            resolution = RESOLUTION_DAY
+            for candidate in (RESOLUTION_5_MINUTES, RESOLUTION_HOUR):
+                if span / RESOLUTION_SECONDS[candidate] <= 600:
+                    resolution = candidate
+                    break
+        return cls.objects.filter(
+            server=server, resolution=resolution, bucket__lt=end,
+            bucket__gt=start - timezone.timedelta(seconds=RESOLUTION_SECONDS[resolution]),
+        ).order_by("bucket", "coalition")
+
+    def __str__(self):
+        return f"{self.coalition} on {self.server}, {self.resolution} from {self.bucket}"
+
+
+# Leaderboard categories of LeaderboardEntry; "points" is the sum of all point fields
+LEADERBOARD_POINTS = "points"
+LEADERBOARD_FLIGHT_TIME = "flight_time"
+LEADERBOARD_SORTIES = "sorties"
+LEADERBOARD_CATEGORIES = (LEADERBOARD_POINTS,) + POINTS_FIELDS + (
+    "air_kills", "ground_kills", "ship_kills", LEADERBOARD_FLIGHT_TIME, LEADERBOARD_SORTIES)
+LEADERBOARD_CATEGORY_CHOICES = tuple(
+    (category, category.replace("_", " ").capitalize()) for category in LEADERBOARD_CATEGORIES)
+
+
+class LeaderboardEntry(models.Model):
+    """
+    Model that stores a pilot's total and rank in one category of a tour's leaderboard.
+
+    Leaderboards are materialised from the tour's sorties by stats.leaderboards and rebuilt when
+    sorties of the tour are imported or re-scored, so reading a page never aggregates sorties.
+    Tour IDs are per stats server, so every server has its own leaderboards.
+    """
+    server = models.ForeignKey(IL2StatsServer, on_delete=models.CASCADE)
+    tour_id = models.IntegerField()
+    category = models.CharField(max_length=24, choices=LEADERBOARD_CATEGORY_CHOICES)
+    pilot = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Points, kills, flight time in seconds or number of sorties
+    value = models.DecimalField(decimal_places=2, max_digits=14)
+    # Competition rank (ties share a rank) and 1-based position of the entry in the leaderboard
+    rank = models.PositiveIntegerField()
+    position = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = _("Leaderboard Entry")
+        verbose_name_plural = _("Leaderboard Entries")
+        ordering = ["server", "tour_id", "category", "position"]
+        constraints = [
+            # Also the index pages are read from
+            models.UniqueConstraint(fields=["server", "tour_id", "category", "position"],
+                                    name="stats_leaderboard_position_unique"),
+            models.UniqueConstraint(fields=["server", "tour_id", "category", "pilot"],
+                                    name="stats_leaderboard_pilot_unique"),
+        ]
+
+    @classmethod
+    def page(cls, server, tour_id, category, page=1, per_page=50):
+        """
+        Get a page of a tour's leaderboard.
+
+        Reads only the entries of the page, by a range of positions on the unique index.
+
+        @param server: IL2StatsServer object
+        @param tour_id: ID of the tour on the server
+        @param category: one of LEADERBOARD_CATEGORIES
+        @param page: 1-based number of the page
+        @param per_page: number of entries per page
+        @return: QuerySet of LeaderboardEntry objects, best first
+        """
+        offset = (page - 1) * per_page
+        return cls.objects.filter(
+            server=server, tour_id=tour_id, category=category, position__gt=offset, position__lte=offset + per_page,
+        ).select_related("pilot").order_by("position")
+
+    @classmethod
+    def cached_page(cls, server, tour_id, category, page=1, per_page=50):
+        """
+        Get a page of a tour's leaderboard; cached until the tour's leaderboards are rebuilt.
+
+        @return: list of LeaderboardEntry objects (with their pilots), best first; see page()
+        """
+        generation = get_generation(tour_generation_key(server.id, tour_id))
+        return get_or_set(leaderboard_key(server.id, tour_id, generation, category, page, per_page),
+                          lambda: list(cls.page(server, tour_id, category, page, per_page)), LEADERBOARD_CACHE_TTL)
+
+    def __str__(self):
+        return f"{self.rank}. {self.pilot} - {self.category} of tour {self.tour_id} on {self.server}"
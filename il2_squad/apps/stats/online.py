@@ -0,0 +1,197 @@
+"""
+Parsing and ingestion of il2stats "online" pages (the list of players currently on a server).
+
+A poll is parsed completely first and then reconciled with the DB in bulk, so the number of
+queries per poll does not depend on the number of players online.
+"""
+import logging
+from urllib.parse import urljoin
+from lxml import html
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .instrumentation import timed
+from .caching import get_or_set, invalidate_player_cnts, SQUAD_MEMBERS_KEY, SQUAD_MEMBERS_CACHE_TTL
+from .models import SomePilot, SomePilotName, PlayerOccurrence, PlayerSession, PollSnapshot, COALITION_BLUE, COALITION_RED
+from .rollups import update_rollups
+from .scrapers.sessions import get_session
+
+
+logger = logging.getLogger("management")
+
+REQUEST_TIMEOUT = getattr(settings, "REQUEST_TIMEOUT", 120)  # seconds; stats servers tend to be slow
+
+# XPaths to the root elements of the coalitions on the online page
+COALITION_XPATHS = (
+    '//div[@class="online_players"]//div[@class="online_coal_1"]',
+    '//div[@class="online_players"]//div[@class="online_coal_2"]',
+)
+
+
+class OnlinePlayer(object):
+    """
+    A player found on the online page.
+    """
+    __slots__ = ("id_on_site", "name", "url", "coalition")
+
+    def __init__(self, id_on_site, name, url, coalition):
+        self.id_on_site = id_on_site
+        self.name = name
+        self.url = url
+        self.coalition = coalition
+
+    def __repr__(self):
+        return f"<OnlinePlayer {self.name} ({self.id_on_site}) in coalition {self.coalition}>"
+
+
+def parse_coalition(tree, xpath):
+    """
+    Parse a coalition of online players.
+
+    @param tree: lxml tree object (parsed HTML page)
+    @param xpath: XPath to the root element of the coalition
+    @return: list of OnlinePlayer objects
+    @raise ValueError: if the page has no such coalition (e.g. a maintenance page or a changed
+                       layout); unlike an empty coalition, that's no reason to record 0 players
+    """
+    # Get coalition root element
+    root_el = tree.xpath(xpath)
+    if not root_el:
+        raise ValueError(f"Could not find node {xpath}")
+    root_el = root_el[0]
+
+    # header
+    header = root_el.xpath('.//div[@class="header"]')
+    coalition_name = header[0].text if header else None
+    if not coalition_name:
+        raise ValueError(f"Could not get coalition name of {xpath}")
+
+    coalition = COALITION_RED if "allies" in coalition_name.lower() else COALITION_BLUE
+
+    # Player list
+    players = []
+    for row in root_el.xpath('./div[@class="content_table"]/a[@class="row"]'):
+        href = row.get("href")
+        id_on_site = int(href.strip("/").split("/")[-2])
+        name = row.xpath('./div[@class="cell"]')[0].text
+        players.append(OnlinePlayer(id_on_site, name, href, coalition))
+    return players
+
+
+def parse_online_page(tree):
+    """
+    Parse all online players of an online page.
+
+    @param tree: lxml tree object (parsed HTML page)
+    @return: list of OnlinePlayer objects
+    @raise ValueError: if the page's coalitions could not be parsed, see parse_coalition()
+    """
+    players = []
+    for xpath in COALITION_XPATHS:
+        players += parse_coalition(tree, xpath)
+    return players
+
+
+def fetch_online_players(server):
+    """
+    Load and parse the online page of a server.
+
+    This only talks to the stats server, not to the DB, so it can run in a separate thread.
+
+    @param server: IL2StatsServer object
+    @return: tuple (list of OnlinePlayer objects, time of the poll)
+    @raise ValueError: if the page could not be parsed; the poll must not be stored then
+    """
+    # Build online list URL
+    url = urljoin(server.url, "/en/online")
+    response = get_session(server).get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    timestamp = timezone.now()
+    with timed("parse"):
+        tree = html.fromstring(response.content)
+    with timed("extract"):
+        return parse_online_page(tree), timestamp
+
+
+def get_squad_members():
+    """
+    Get the squad members, i.e. the users, by name; cached until a user is saved or deleted.
+
+    @return: dict username -> user ID
+    """
+    return get_or_set(SQUAD_MEMBERS_KEY, lambda: dict(User.objects.values_list("username", "id")),
+                      SQUAD_MEMBERS_CACHE_TTL)
+
+
+def ingest_online_players(server, players, timestamp):
+    """
+    Store a poll of online players.
+
+    @param server: IL2StatsServer object
+    @param players: list of OnlinePlayer objects
+    @param timestamp: time of the poll; all players of a poll share the same timestamp
+    @return: list of created PlayerOccurrence objects
+    """
+    # A player is only counted once per poll and coalition
+    unique = {}
+    for player in players:
+        unique.setdefault((player.id_on_site, player.coalition), player)
+    players = list(unique.values())
+
+    with transaction.atomic():
+        # With nobody online there are no pilots or occurrences to store, but sessions end and the
+        # poll's counts (0) are recorded all the same
+        pilots = {}
+        occurrences = []
+        if players:
+            # Known pilots, then the new ones in one go
+            ids_on_site = {player.id_on_site for player in players}
+            pilots = {pilot.id_on_site: pilot for pilot in SomePilot.objects.filter(id_on_site__in=ids_on_site)}
+            new_pilots = [SomePilot(site=server, id_on_site=id_on_site) for id_on_site in sorted(ids_on_site - set(pilots))]
+            for pilot in SomePilot.objects.bulk_create(new_pilots):
+                pilots[pilot.id_on_site] = pilot
+
+            # Occurrence counters are incremented atomically in the DB
+            for coalition, field in ((COALITION_RED, "red_occ_count"), (COALITION_BLUE, "blue_occ_count")):
+                pilot_ids = [pilots[player.id_on_site].id for player in players if player.coalition == coalition]
+                if pilot_ids:
+                    SomePilot.objects.filter(id__in=pilot_ids).update(**{field: F(field) + 1})
+
+            # Squad members
+            members = get_squad_members()
+            squad_pilots = []
+            for player in players:
+                pilot = pilots[player.id_on_site]
+                member_id = members.get(player.name)
+                if member_id and pilot.squad_pilot_id != member_id:
+                    pilot.squad_pilot_id = member_id
+                    squad_pilots.append(pilot)
+            if squad_pilots:
+                SomePilot.objects.bulk_update(squad_pilots, ["squad_pilot"])
+
+            SomePilotName.track_names(
+                [(player.id_on_site, player.name, player.url) for player in players], timestamp,
+                pilot_ids={id_on_site: pilot.id for id_on_site, pilot in pilots.items()},
+            )
+
+            occurrences = PlayerOccurrence.objects.bulk_create([
+                PlayerOccurrence(
+                    pilot=pilots[player.id_on_site],
+                    server=server,
+                    coalition=player.coalition,
+                    timestamp=timestamp,
+                ) for player in players
+            ])
+
+        PlayerSession.track(server, [(pilots[player.id_on_site].id, player.coalition) for player in players], timestamp)
+
+        # Player counts of the poll, for player_cnt_at
+        red_count = sum(1 for player in players if player.coalition == COALITION_RED)
+        PollSnapshot.record(server, timestamp, red_count, len(players) - red_count)
+        update_rollups(server, timestamp)
+        # The new snapshot may be the closest one for cached player counts
+        transaction.on_commit(lambda: invalidate_player_cnts(server.id))
+    logger.info(f"Stored {len(occurrences)} online players on {server}")
+    return occurrences
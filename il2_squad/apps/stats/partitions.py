@@ -0,0 +1,136 @@
+"""
+Monthly range partitions of the player occurrence table (stats_playeroccurrence).
+
+The table is partitioned by `timestamp` (see migration 0010): one partition per calendar month
+(UTC), named stats_playeroccurrence_yYYYYmMM, plus a default partition that catches rows no
+monthly partition exists for. Partitions for the coming months are created ahead of time by the
+pollers and the create_occurrence_partitions command; retention drops whole partitions.
+"""
+import logging
+import re
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import PlayerOccurrence
+
+
+logger = logging.getLogger("management")
+
+# Number of months ahead of the current one that partitions are created for
+PLAYER_OCCURRENCE_PARTITIONS_AHEAD = getattr(settings, "PLAYER_OCCURRENCE_PARTITIONS_AHEAD", 3)
+
+TABLE = PlayerOccurrence._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME_RE = re.compile(rf"^{TABLE}_y(\d{{4}})m(\d{{2}})$")
+COLUMNS = '"id", "server_id", "pilot_id", "timestamp", "coalition"'
+
+
+def month_start(timestamp, months=0):
+    """
+    Get the start of the (UTC) month of a timestamp, optionally moved by some months.
+
+    @param timestamp: aware datetime
+    @param months: number of months to move forward (or back, if negative)
+    @return: aware datetime
+    """
+    timestamp = timestamp.astimezone(dt_timezone.utc)
+    month = timestamp.year * 12 + timestamp.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    """
+    Get the name of the partition of a month.
+    """
+    return f"{TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def get_partitions():
+    """
+    Get the monthly partitions of the occurrence table.
+
+    @return: dict partition name -> start of its month, ordered by month
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass;""", [TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            partitions[name] = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=dt_timezone.utc)
+    return dict(sorted(partitions.items(), key=lambda item: item[1]))
+
+
+def create_partition(month):
+    """
+    Create the partition of a month.
+
+    Rows of the month that ended up in the default partition are moved into the new partition.
+
+    @param month: aware datetime in the month
+    @return: name of the partition
+    """
+    start = month_start(month)
+    end = month_start(month, 1)
+    name = partition_name(start)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Attaching a filled table instead of creating the partition directly, so rows in the
+        # default partition don't make this fail
+        cursor.execute(f'CREATE TABLE "{name}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS);')
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM "{DEFAULT_PARTITION}" WHERE "timestamp" >= %s AND "timestamp" < %s
+                RETURNING {COLUMNS}
+            )
+            INSERT INTO "{name}" ({COLUMNS}) SELECT {COLUMNS} FROM moved;""", [start, end])
+        if cursor.rowcount:
+            logger.warning(f"Moved {cursor.rowcount} player occurrences from the default partition to {name}")
+        cursor.execute(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s);',
+                       [start, end])
+    logger.info(f"Created partition {name}")
+    return name
+
+
+def ensure_partitions(ahead=None, now=None):
+    """
+    Make sure partitions exist for the current month and the months ahead.
+
+    @param ahead: number of months ahead; if None, PLAYER_OCCURRENCE_PARTITIONS_AHEAD is used
+    @param now: current time; if None, timezone.now() is used
+    @return: list of names of the created partitions
+    """
+    ahead = PLAYER_OCCURRENCE_PARTITIONS_AHEAD if ahead is None else ahead
+    now = now or timezone.now()
+    existing = get_partitions()
+    created = []
+    for months in range(ahead + 1):
+        month = month_start(now, months)
+        if partition_name(month) not in existing:
+            created.append(create_partition(month))
+    return created
+
+
+def drop_partitions(before):
+    """
+    Drop the partitions of all months that ended before a point in time.
+
+    @param before: aware datetime; partitions are only dropped if all of their month lies before it
+    @return: list of names of the dropped partitions
+    """
+    dropped = []
+    for name, month in get_partitions().items():
+        if month_start(month, 1) > before:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}";')
+            cursor.execute(f'DROP TABLE "{name}";')
+        logger.info(f"Dropped partition {name}")
+        dropped.append(name)
+    return dropped
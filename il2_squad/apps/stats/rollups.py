@@ -0,0 +1,154 @@
+"""
+Population rollups (PopulationRollup) and retention of raw player occurrences.
+
+Player counts per poll come from PollSnapshot objects, the number of distinct pilots from the
+PlayerOccurrence objects of a bucket. After a poll, only the buckets containing it are refreshed.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import PlayerOccurrence, RESOLUTION_SECONDS, COALITION_RED, COALITION_BLUE
+from .partitions import drop_partitions, DEFAULT_PARTITION
+
+
+logger = logging.getLogger("management")
+
+# Raw PlayerOccurrence objects older than this are deleted by prune_occurrences; None keeps them forever.
+# Rollups and poll snapshots are kept, so this should be longer than a day (the largest bucket).
+# Deleting happens by monthly partition (see stats.partitions).
+PLAYER_OCCURRENCE_RETENTION_DAYS = getattr(settings, "PLAYER_OCCURRENCE_RETENTION_DAYS", None)
+# Number of rows deleted per statement while pruning a single server
+PRUNE_BATCH_SIZE = getattr(settings, "PLAYER_OCCURRENCE_PRUNE_BATCH_SIZE", 50000)
+
+# Buckets are aligned to the epoch; for all resolutions this is the same as aligning to UTC days
+BUCKET_SQL = "to_timestamp(floor(extract(epoch FROM snapshot.timestamp) / %(width)s) * %(width)s)"
+
+REFRESH_SQL = f"""
+    INSERT INTO stats_populationrollup
+        (server_id, coalition, resolution, bucket, samples, min_players, avg_players, max_players, unique_pilots)
+    SELECT buckets.server_id, buckets.coalition, %(resolution)s, buckets.bucket,
+           COUNT(*), MIN(buckets.players), AVG(buckets.players), MAX(buckets.players),
+           (SELECT COUNT(DISTINCT occurrence.pilot_id) FROM stats_playeroccurrence AS occurrence
+            WHERE occurrence.server_id = buckets.server_id
+              AND occurrence.coalition = buckets.coalition
+              AND occurrence.timestamp >= buckets.bucket
+              AND occurrence.timestamp < buckets.bucket + %(width)s * INTERVAL '1 second')
+    FROM (
+        SELECT snapshot.server_id, {BUCKET_SQL} AS bucket, coalitions.coalition, coalitions.players
+        FROM stats_pollsnapshot AS snapshot
+        CROSS JOIN LATERAL (VALUES (%(red)s, snapshot.red_count), (%(blue)s, snapshot.blue_count))
+            AS coalitions(coalition, players)
+        WHERE snapshot.server_id = %(server_id)s
+          AND snapshot.timestamp >= %(start)s AND snapshot.timestamp < %(end)s
+    ) AS buckets
+    GROUP BY buckets.server_id, buckets.coalition, buckets.bucket
+    ON CONFLICT (server_id, resolution, bucket, coalition) DO UPDATE
+    SET samples = EXCLUDED.samples,
+        min_players = EXCLUDED.min_players,
+        avg_players = EXCLUDED.avg_players,
+        max_players = EXCLUDED.max_players,
+        -- Pruned occurrences must not lower the count of a rebuilt bucket
+        unique_pilots = GREATEST(stats_populationrollup.unique_pilots, EXCLUDED.unique_pilots);"""
+
+
+def bucket_range(timestamp, resolution):
+    """
+    Get the bucket a timestamp falls into.
+
+    @param timestamp: aware datetime
+    @param resolution: one of RESOLUTION_CHOICES
+    @return: tuple (start, end) of the bucket
+    """
+    width = RESOLUTION_SECONDS[resolution]
+    start = int(timestamp.timestamp() // width) * width
+    start = datetime.fromtimestamp(start, tz=dt_timezone.utc)
+    return start, start + timedelta(seconds=width)
+
+
+def refresh_rollups(server, start, end, resolution):
+    """
+    (Re)build a server's rollups of one resolution for all buckets with polls in a time range.
+
+    @param server: IL2StatsServer object
+    @param start: start of the range; should be aligned to the resolution's buckets
+    @param end: end of the range (exclusive); should be aligned to the resolution's buckets
+    @param resolution: one of RESOLUTION_CHOICES
+    @return: number of rollups written
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(REFRESH_SQL, {
+            "server_id": server.id, "resolution": resolution, "width": RESOLUTION_SECONDS[resolution],
+            "start": start, "end": end, "red": COALITION_RED, "blue": COALITION_BLUE,
+        })
+        return cursor.rowcount
+
+
+def update_rollups(server, timestamp):
+    """
+    Refresh the rollups of all resolutions containing a poll; one query per resolution.
+
+    @param server: IL2StatsServer object
+    @param timestamp: time of the poll
+    """
+    for resolution in RESOLUTION_SECONDS:
+        refresh_rollups(server, *bucket_range(timestamp, resolution), resolution)
+
+
+def build_rollups(server, start=None, end=None):
+    """
+    Build all rollups of a server from its poll snapshots, e.g. after backfilling them.
+
+    @param server: IL2StatsServer object
+    @param start: only build buckets from this time on; if None, from the first poll
+    @param end: only build buckets up to this time; if None, up to now
+    @return: number of rollups written
+    """
+    start = start or datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+    end = end or timezone.now()
+    count = 0
+    for resolution in RESOLUTION_SECONDS:
+        with transaction.atomic():
+            count += refresh_rollups(server, bucket_range(start, resolution)[0], bucket_range(end, resolution)[1],
+                                     resolution)
+    return count
+
+
+def prune_occurrences(days=None, server=None):
+    """
+    Delete raw PlayerOccurrence objects older than the retention period.
+
+    For all servers, whole monthly partitions are dropped once all of their month is older than
+    the retention period, so rows are kept up to a month longer than the period. Single servers'
+    occurrences are deleted row by row, in batches.
+
+    @param days: retention period in days; if None, PLAYER_OCCURRENCE_RETENTION_DAYS is used
+    @param server: IL2StatsServer object; if None, occurrences of all servers are pruned
+    @return: tuple (list of names of dropped partitions, number of individually deleted occurrences)
+    """
+    days = days if days is not None else PLAYER_OCCURRENCE_RETENTION_DAYS
+    if days is None:
+        return [], 0
+    cutoff = timezone.now() - timedelta(days=days)
+
+    if server is None:
+        dropped = drop_partitions(cutoff)
+        # Only rows that missed their monthly partition are deleted individually
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE "timestamp" < %s;', [cutoff])
+            deleted = cursor.rowcount
+        logger.info(f"Dropped {len(dropped)} partitions and {deleted} player occurrences older than {cutoff}")
+        return dropped, deleted
+
+    occurrences = PlayerOccurrence.objects.filter(server=server, timestamp__lt=cutoff).order_by()
+    deleted = 0
+    while True:
+        # Small transactions, so pruning a long history doesn't hold locks for long
+        ids = list(occurrences.values_list("id", flat=True)[:PRUNE_BATCH_SIZE])
+        if not ids:
+            break
+        count, _ = PlayerOccurrence.objects.filter(id__in=ids).delete()
+        deleted += count
+    logger.info(f"Pruned {deleted} player occurrences of {server} older than {cutoff}")
+    return [], deleted
@@ -0,0 +1,174 @@
+"""
+Rules driven scoring of sorties (the point fields of ModelWithPoints).
+
+Sorties are scored in batches: their features (flight minutes, kills, ...) are stacked into
+columns and multiplied with the rules' weight matrix in one go, so scoring a whole tour costs
+about as much as scoring a single sortie.
+
+Rules (SCORING_RULES) map point fields to rules. A rule holds a weight per feature and optionally
+`min`/`max` (clamp the points) and `min_flight_minutes` (shorter sorties get no points of this
+kind). Point fields without a rule are scored 0. Example:
+
+    SCORING_RULES = {
+        "sortie_points": {"flight_minutes": 0.1, "max": 10, "min_flight_minutes": 10},
+        "air_combat_points": {"air_kills": 2, "was_wounded": -0.5, "min": 0},
+    }
+
+The default rules take over the score the stats site awarded (feature `site_points`) as sortie
+points; a squad's own scoring system has to be configured.
+"""
+import logging
+from decimal import Decimal
+from itertools import groupby
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from .aggregates import rebuild_life_totals
+from .leaderboards import rebuild_leaderboards
+from .models import Sortie, POINTS_FIELDS
+
+
+logger = logging.getLogger("management")
+
+# Features a rule can weigh; site_points is the score awarded by the stats site
+FEATURES = ("flight_minutes", "air_kills", "ground_kills", "ship_kills", "was_wounded", "site_points")
+# Sortie fields the features are computed from, in the order features_of() takes them
+FEATURE_FIELDS = ("start_at", "end_at", "air_kills", "ground_kills", "ship_kills", "was_wounded", "site_points")
+# Keys of a rule that are not feature weights
+RULE_OPTIONS = ("min", "max", "min_flight_minutes")
+
+DEFAULT_SCORING_RULES = {
+    "sortie_points": {"site_points": 1},
+}
+SCORING_RULES = getattr(settings, "SCORING_RULES", DEFAULT_SCORING_RULES)
+
+
+class ScoringEngine(object):
+    """
+    Scores batches of sorties according to a set of rules.
+    """
+
+    def __init__(self, rules=None):
+        """
+        Compile the rules into a weight matrix and clamping vectors.
+
+        @param rules: dict point field -> rule; if None, SCORING_RULES is used
+        @raise ValueError: if the rules contain unknown point fields, features or options
+        """
+        rules = SCORING_RULES if rules is None else rules
+        unknown = set(rules) - set(POINTS_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown point fields in scoring rules: {', '.join(sorted(unknown))}")
+
+        self.weights = np.zeros((len(FEATURES), len(POINTS_FIELDS)))
+        self.minimum = np.full(len(POINTS_FIELDS), -np.inf)
+        self.maximum = np.full(len(POINTS_FIELDS), np.inf)
+        self.min_flight_minutes = np.zeros(len(POINTS_FIELDS))
+        for field, rule in rules.items():
+            column = POINTS_FIELDS.index(field)
+            unknown = set(rule) - set(FEATURES) - set(RULE_OPTIONS)
+            if unknown:
+                raise ValueError(f"Unknown features in scoring rule for {field}: {', '.join(sorted(unknown))}")
+            for feature in FEATURES:
+                self.weights[FEATURES.index(feature), column] = rule.get(feature, 0)
+            self.minimum[column] = rule.get("min", -np.inf)
+            self.maximum[column] = rule.get("max", np.inf)
+            self.min_flight_minutes[column] = rule.get("min_flight_minutes", 0)
+
+    def score(self, features):
+        """
+        Score a batch of sorties.
+
+        @param features: array of shape (number of sorties, len(FEATURES)), see features_of()
+        @return: array of shape (number of sorties, len(POINTS_FIELDS)), rounded to cents
+        """
+        points = np.clip(features @ self.weights, self.minimum, self.maximum)
+        points[features[:, [FEATURES.index("flight_minutes")]] < self.min_flight_minutes] = 0
+        # Round half up, like Decimal's default for money; plain np.round rounds half to even
+        return np.floor(points * 100 + 0.5) / 100
+
+    @staticmethod
+    def features_of(rows):
+        """
+        Build the feature columns of a batch of sorties.
+
+        @param rows: iterable of tuples of the FEATURE_FIELDS (start_at, end_at, air_kills, ..., site_points)
+        @return: array of shape (number of rows, len(FEATURES))
+        """
+        rows = list(rows)
+        features = np.zeros((len(rows), len(FEATURES)))
+        if rows:
+            start_at, end_at, air_kills, ground_kills, ship_kills, was_wounded, site_points = zip(*rows)
+            features[:, 0] = [(end - start).total_seconds() / 60 for start, end in zip(start_at, end_at)]
+            features[:, 1:] = np.column_stack([air_kills, ground_kills, ship_kills, was_wounded,
+                                               [float(points) for points in site_points]])
+        return features
+
+    def score_records(self, records):
+        """
+        Score scraped sorties.
+
+        @param records: list of SortieRecord objects
+        @return: list of dicts point field -> Decimal, one per record
+        """
+        features = self.features_of(
+            (record.start_at, record.end_at, record.air_kills, record.ground_kills, record.ship_kills,
+             record.was_wounded, record.points) for record in records)
+        return [dict(zip(POINTS_FIELDS, to_decimals(row))) for row in self.score(features)]
+
+
+def to_decimals(row):
+    """
+    Convert a row of scored points to Decimals with two places.
+    """
+    return [Decimal(f"{value:.2f}") for value in row]
+
+
+def rescore(engine=None, pilot=None, tour_id=None):
+    """
+    Score stored sorties again, e.g. after the rules changed, and rebuild the lives' totals and the
+    leaderboards of the re-scored tours.
+
+    Sorties are scored and updated tour by tour, with one UPDATE per tour.
+
+    @param engine: ScoringEngine object; if None, one with SCORING_RULES is used
+    @param pilot: only re-score this pilot's (User) sorties, if given
+    @param tour_id: only re-score this tour, if given
+    @return: number of re-scored sorties
+    """
+    engine = engine or ScoringEngine()
+    sorties = Sortie.objects.order_by("server_id", "tour_id", "id")
+    if pilot is not None:
+        sorties = sorties.filter(pilot=pilot)
+    if tour_id is not None:
+        sorties = sorties.filter(tour_id=tour_id)
+    rows = sorties.values_list("server_id", "tour_id", "id", "pilot_id", *FEATURE_FIELDS)
+
+    count = 0
+    pilot_ids = set()
+    tours = set()
+    for (server_id, tour_id), tour_rows in groupby(rows.iterator(chunk_size=10000), key=lambda row: row[:2]):
+        tour_rows = list(tour_rows)
+        points = engine.score(engine.features_of(row[4:] for row in tour_rows))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE stats_sortie AS sortie
+                SET {", ".join(f"{field} = scored.{field}" for field in POINTS_FIELDS)}
+                FROM unnest(%s::bigint[], {", ".join("%s::numeric[]" for _ in POINTS_FIELDS)})
+                    AS scored(id, {", ".join(POINTS_FIELDS)})
+                WHERE sortie.id = scored.id;""",
+                [[row[2] for row in tour_rows]] + [to_decimals(column) for column in points.T])
+        pilot_ids.update(row[3] for row in tour_rows)
+        # Sorties of an unknown server are on no leaderboard
+        if server_id is not None:
+            tours.add((server_id, tour_id))
+        count += len(tour_rows)
+        logger.info(f"Re-scored {len(tour_rows)} sorties of tour {tour_id} on server {server_id}")
+
+    # Lives sum up the points of their sorties
+    for pilot_id in sorted(pilot_ids):
+        rebuild_life_totals(User(id=pilot_id))
+    rebuild_leaderboards(tours)
+    return count
@@ -3,13 +3,18 @@ Base class for stats page scrapers.
 """
 from django.conf import settings
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from lxml import html
-import requests
 import importlib
+from .sessions import get_session
+from ..instrumentation import timed
 
 
 logger = logging.getLogger("scraper")
 REQUEST_TIMEOUT = getattr(settings, "REQUEST_TIMEOUT", 120)  # seconds; stats servers tend to be slow
+# Number of pages fetched in parallel from a single stats server
+SCRAPER_CONCURRENCY = getattr(settings, "SCRAPER_CONCURRENCY", 1)
 
 IL2STATS_SCRAPER_IDENTIFIER = "il2stats"
 DEFAULT_SCRAPER_IDENTIFIER = IL2STATS_SCRAPER_IDENTIFIER
@@ -26,6 +31,7 @@ SCRAPER_MAP = {
 }
 
 
+@lru_cache(maxsize=None)
 def get_scraper_class(scraper_identifier):
     """
     Return a scraper class for a scraper identifier.
@@ -38,28 +44,174 @@ def get_scraper_class(scraper_identifier):
     return scraper_class
 
 
+def get_scraper_context(server, concurrency=None, cache=None):
+    """
+    Create the scraper context for a server.
+
+    Create this once per server and run, and get the per-pilot scrapers from it.
+
+    @param server: IL2StatsServer object
+    @param concurrency: maximum number of parallel requests to the server
+    @param cache: optional ResponseCache for pages that never change
+    @return: scraper context object
+    """
+    scraper_class = get_scraper_class(server.scraper_type)
+    return scraper_class.context_class(server, concurrency, cache)
+
+
+class BaseScraperContext(object):
+    """
+    Server level state shared by all scrapers of one stats server during a run.
+
+    This holds everything that does not depend on the pilot: the HTTP session, caches and
+    whatever the server specific subclasses can set up once (e.g. the tour list or compiled
+    regular expressions), so scraping a whole squad on one server only pays for it once.
+    """
+    # Scraper class handed out by scraper()
+    scraper_class = None
+
+    def __init__(self, server, concurrency=None, cache=None):
+        """
+        @param server: IL2StatsServer object
+        @param concurrency: maximum number of parallel requests to the stats server;
+                            defaults to settings.SCRAPER_CONCURRENCY
+        @param cache: optional ResponseCache for pages that never change (e.g. sortie logs)
+        """
+        self.server = server
+        self.concurrency = max(1, concurrency or SCRAPER_CONCURRENCY)
+        self.cache = cache
+        # Pooled keep-alive session shared by everything talking to this server
+        self.session = get_session(server, self.concurrency)
+
+    def scraper(self, stats_page):
+        """
+        Return a scraper for a pilot's stats page on this server.
+        """
+        return self.scraper_class(stats_page, self)
+
+    def fetch_page(self, url, cache_key=None):
+        """
+        GET a page's content.
+
+        If a cache key is given and the context has a cache, the page is served from the cache;
+        stale cache entries are revalidated with a conditional GET.
+
+        @param url: URL of the page
+        @param cache_key: optional key (e.g. sortie ID) of a page that never changes
+        @return: the page content (bytes)
+        """
+        entry = None
+        headers = {}
+        if self.cache is not None and cache_key is not None:
+            entry = self.cache.get(self.server, cache_key)
+            if entry is not None:
+                if entry.is_fresh(self.cache.revalidate_after):
+                    return entry.content
+                headers = entry.conditional_headers()
+
+        response = self.session.get(url, timeout=REQUEST_TIMEOUT, headers=headers)
+        if entry is not None and response.status_code == 304:
+            self.cache.revalidated(self.server, cache_key, entry)
+            return entry.content
+        response.raise_for_status()
+        if self.cache is not None and cache_key is not None:
+            self.cache.put(self.server, cache_key, response.content, response.headers)
+        return response.content
+
+    def fetch_tree(self, url, cache_key=None):
+        """
+        GET a page and parse its content with lxml.
+
+        @param url: URL of the page
+        @param cache_key: optional key of a page that never changes, see fetch_page()
+        @return: the parsed lxml tree
+        """
+        content = self.fetch_page(url, cache_key)
+        with timed("parse"):
+            return html.fromstring(content)
+
+    def fetch_trees(self, urls, cache_keys=None, parse=None):
+        """
+        GET and parse several pages, up to `self.concurrency` of them in parallel.
+
+        Results are yielded in the order of `urls`, no matter in which order the
+        requests finish, so consumers (e.g. the DB writer) see a deterministic sequence.
+
+        @param urls: list of page URLs
+        @param cache_keys: optional list of cache keys, one per URL (see fetch_page())
+        @param parse: optional function(tree, cache_key) that is run in the fetching thread; its
+                      result is yielded instead of the tree, so the tree can be freed right away
+        @return: generator of (url, tree or parse result) tuples
+        """
+        if cache_keys is None:
+            cache_keys = [None] * len(urls)
+
+        def fetch(url, cache_key):
+            tree = self.fetch_tree(url, cache_key)
+            if not parse:
+                return tree
+            with timed("extract"):
+                return parse(tree, cache_key)
+
+        if self.concurrency == 1 or len(urls) < 2:
+            for url, cache_key in zip(urls, cache_keys):
+                yield url, fetch(url, cache_key)
+            return
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="scraper")
+        try:
+            yield from zip(urls, executor.map(fetch, urls, cache_keys))
+        finally:
+            # If the consumer stopped early, queued fetches are cancelled; only the running ones are
+            # waited for, so no thread outlives the generator
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
 class BaseScraper(object):
     """
     Base class for stats page scrapers.
+
+    Scrapers are lightweight per-pilot workers; everything that is shared between the pilots
+    of a server lives in the scraper context.
     """
+    # Server level context class of this scraper
+    context_class = BaseScraperContext
 
-    def __init__(self, stats_page):
+    def __init__(self, stats_page, context=None):
         """
         Initialize the scraper with a PilotStatsPage object.
 
-        This GETs the request page and parses its content with lxml.
+        @param stats_page: the PilotStatsPage to scrape
+        @param context: scraper context of the stats page's server; if omitted, a context
+                        is created just for this scraper
         """
-        # The base class stores a reference to the stats page object, GETs and parses it.
         self.stats_page = stats_page
-        response = requests.get(stats_page.url, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        self.tree = html.fromstring(response.content)
-        logger.info(f"Successfully loaded {stats_page.url}")
+        self.context = context or self.context_class(stats_page.server)
 
-    def scrape(self, tour_id=None):
+    def scrape_tours(self, tour_id=None, incremental=False):
         """
-        Scrape a pilot's stats page.
+        Scrape a pilot's stats page tour by tour.
+
+        Generator yielding a (tour ID, records, high-water mark, is complete) tuple for each walked
+        tour, once all of its sorties were scraped; the next tour is only fetched when the consumer
+        asks for it, so each tour can be stored before. The records are a list of SortieRecord
+        objects (see records.py); the high-water mark is the highest sortie ID up to which all
+        sorties of the tour's list were scraped, and a tour is complete if it is closed and was
+        scraped completely.
 
         @param tour_id: Optional tour ID to scrape; if omitted, scrape all tours.
+        @param incremental: Only import sorties newer than the last import.
         """
         raise NotImplementedError()
+
+    def scrape(self, tour_id=None, incremental=False):
+        """
+        Scrape a pilot's stats page.
+
+        Generator yielding a SortieRecord (see records.py) for each scraped sortie, tour by tour.
+
+        @param tour_id: Optional tour ID to scrape; if omitted, scrape all tours.
+        @param incremental: Only import sorties newer than the last import.
+        """
+        for _, records, _, _ in self.scrape_tours(tour_id, incremental):
+            yield from records
@@ -0,0 +1,143 @@
+"""
+Record and replay of the HTTP traffic to stats servers.
+
+In record mode, every response of the shared sessions (see sessions.use_archive()) is written to
+a compressed archive; in replay mode, responses are served from the archive and the network is
+never touched. This makes import and polling runs reproducible, e.g. for profiling.
+
+The archive is a zip file. Response n (counting from 0) of a URL is stored as
+<sha1 of the URL>/<n>.body (the content) and <n>.json (URL, status and headers). A URL requested
+several times (e.g. the online page, once per poll) is replayed in the recorded order; after
+the last recorded response, the last one is served again. Every replay starts again from the
+first response, so to replay several polls one by one, record each into its own archive.
+Recording into an existing archive appends to it.
+"""
+import hashlib
+import json
+import logging
+import threading
+import zipfile
+from datetime import timedelta
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+
+logger = logging.getLogger("scraper")
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+
+def url_key(url):
+    """
+    Get the archive directory of a URL.
+    """
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+class TrafficArchive(object):
+    """
+    A zip archive of recorded responses; safe to use from several threads.
+    """
+
+    def __init__(self, path, mode):
+        """
+        @param path: path of the archive file
+        @param mode: MODE_RECORD or MODE_REPLAY
+        @raise ValueError: for an unknown mode
+        @raise FileNotFoundError: if the archive to replay doesn't exist
+        """
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise ValueError(f"Unknown archive mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.zip = zipfile.ZipFile(path, "a" if mode == MODE_RECORD else "r", zipfile.ZIP_DEFLATED)
+        # URL key -> number of responses stored in the archive
+        self.stored = {}
+        for name in self.zip.namelist():
+            key, _, member = name.partition("/")
+            if member.endswith(".json"):
+                self.stored[key] = max(self.stored.get(key, 0), int(member[:-len(".json")]) + 1)
+        # URL key -> number of responses replayed so far
+        self.replayed = {}
+
+    def record(self, response):
+        """
+        Store a response.
+        """
+        key = url_key(response.url)
+        meta = {"url": response.url, "status": response.status_code, "reason": response.reason,
+                "headers": dict(response.headers)}
+        content = response.content
+        with self.lock:
+            number = self.stored.get(key, 0)
+            self.stored[key] = number + 1
+            self.zip.writestr(f"{key}/{number}.body", content)
+            self.zip.writestr(f"{key}/{number}.json", json.dumps(meta))
+
+    def replay(self, request):
+        """
+        Build the response to a request from the archive.
+
+        @param request: requests.PreparedRequest object
+        @return: requests.Response object
+        @raise ConnectionError: if the URL was not recorded
+        """
+        key = url_key(request.url)
+        with self.lock:
+            if key not in self.stored:
+                raise ConnectionError(f"{request.url} is not in the archive {self.path}", request=request)
+            number = min(self.replayed.get(key, 0), self.stored[key] - 1)
+            self.replayed[key] = number + 1
+            meta = json.loads(self.zip.read(f"{key}/{number}.json"))
+            content = self.zip.read(f"{key}/{number}.body")
+
+        response = Response()
+        response.request = request
+        response.url = meta["url"]
+        response.status_code = meta["status"]
+        response.reason = meta["reason"]
+        response.headers = CaseInsensitiveDict(meta["headers"])
+        # The content is stored decoded
+        response.headers.pop("Content-Encoding", None)
+        response._content = content
+        response.encoding = None
+        response.elapsed = timedelta(0)
+        return response
+
+    def close(self):
+        with self.lock:
+            self.zip.close()
+        if self.mode == MODE_RECORD:
+            logger.info(f"Recorded {sum(self.stored.values())} responses in {self.path}")
+
+
+class ArchiveAdapter(BaseAdapter):
+    """
+    Transport adapter that records the responses of another adapter, or replays them.
+    """
+
+    def __init__(self, archive, adapter):
+        """
+        @param archive: TrafficArchive object
+        @param adapter: adapter doing the actual requests when recording
+        """
+        super().__init__()
+        self.archive = archive
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        if self.archive.mode == MODE_REPLAY:
+            response = self.archive.replay(request)
+        else:
+            response = self.adapter.send(request, **kwargs)
+            self.archive.record(response)
+        # Like HTTPAdapter, so response hooks and cookies work as usual
+        response.connection = self
+        return response
+
+    def close(self):
+        self.adapter.close()
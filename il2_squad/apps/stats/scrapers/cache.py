@@ -0,0 +1,180 @@
+"""
+Persistent on-disk cache for stats server responses.
+
+Once a sortie is finished, its log page on the stats server never changes. Caching these pages
+on disk makes repeated imports (after a crash, or after a change in the parser) almost free in
+terms of network traffic. Entries are keyed by server and an item ID (e.g. the sortie ID).
+
+Layout: <SCRAPER_CACHE_DIR>/<server pk>/<key>.html.gz holds the gzipped page, <key>.json the
+validators (ETag, Last-Modified) and the time the page was last confirmed by the server. The
+modification time of the page file is bumped on every hit and used for LRU eviction.
+"""
+import gzip
+import json
+import logging
+import os
+import time
+from django.conf import settings
+
+
+logger = logging.getLogger("scraper")
+
+SCRAPER_CACHE_DIR = getattr(settings, "SCRAPER_CACHE_DIR",
+                            os.path.join(settings.BASE_DIR, "cache", "scraper"))
+# Cached pages are served without asking the server for this long, then revalidated
+SCRAPER_CACHE_REVALIDATE_DAYS = getattr(settings, "SCRAPER_CACHE_REVALIDATE_DAYS", 30)
+# Pages not used for this long are evicted
+SCRAPER_CACHE_MAX_AGE_DAYS = getattr(settings, "SCRAPER_CACHE_MAX_AGE_DAYS", 365)
+# If the cache grows beyond this size, the least recently used pages are evicted
+SCRAPER_CACHE_MAX_SIZE_MB = getattr(settings, "SCRAPER_CACHE_MAX_SIZE_MB", 500)
+
+PAGE_SUFFIX = ".html.gz"
+META_SUFFIX = ".json"
+
+
+class CacheEntry(object):
+    """
+    A cached page together with its validators.
+    """
+
+    def __init__(self, content, etag=None, last_modified=None, validated_at=0):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validated_at = validated_at
+
+    def is_fresh(self, revalidate_after):
+        """
+        Check whether the page can be used without asking the server.
+
+        @param revalidate_after: seconds after which a page needs to be revalidated
+        """
+        return time.time() - self.validated_at < revalidate_after
+
+    def conditional_headers(self):
+        """
+        Return the headers needed for a conditional GET of this page.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    """
+    Size- and age-bounded on-disk page cache.
+    """
+
+    def __init__(self, directory=None, revalidate_days=None, max_age_days=None, max_size_mb=None):
+        self.directory = directory or SCRAPER_CACHE_DIR
+        days = 24 * 3600
+        self.revalidate_after = (revalidate_days if revalidate_days is not None else SCRAPER_CACHE_REVALIDATE_DAYS) * days
+        self.max_age = (max_age_days if max_age_days is not None else SCRAPER_CACHE_MAX_AGE_DAYS) * days
+        self.max_size = (max_size_mb if max_size_mb is not None else SCRAPER_CACHE_MAX_SIZE_MB) * 1024 * 1024
+
+    def _path(self, server, key):
+        return os.path.join(self.directory, str(server.pk), str(key))
+
+    def get(self, server, key):
+        """
+        Get a cached page.
+
+        @param server: IL2StatsServer object the page belongs to
+        @param key: item ID, e.g. the sortie ID
+        @return: CacheEntry object, or None if the page is not cached
+        """
+        path = self._path(server, key)
+        try:
+            with open(path + META_SUFFIX) as f:
+                meta = json.load(f)
+            with gzip.open(path + PAGE_SUFFIX, "rb") as f:
+                content = f.read()
+        except (OSError, ValueError, EOFError):
+            return None
+        # Mark as recently used
+        try:
+            os.utime(path + PAGE_SUFFIX)
+        except OSError:
+            pass
+        return CacheEntry(content, **meta)
+
+    def put(self, server, key, content, headers=None):
+        """
+        Store a page.
+
+        @param server: IL2StatsServer object the page belongs to
+        @param key: item ID, e.g. the sortie ID
+        @param content: page content (bytes)
+        @param headers: response headers; used to store the page's validators
+        """
+        headers = headers or {}
+        path = self._path(server, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to temporary files first, so a crash never leaves a half written page behind
+        with gzip.open(path + PAGE_SUFFIX + ".tmp", "wb") as f:
+            f.write(content)
+        os.replace(path + PAGE_SUFFIX + ".tmp", path + PAGE_SUFFIX)
+        self._write_meta(path, {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "validated_at": time.time(),
+        })
+
+    def revalidated(self, server, key, entry):
+        """
+        Record that the server confirmed a cached page is still current (HTTP 304).
+        """
+        entry.validated_at = time.time()
+        self._write_meta(self._path(server, key), {
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+            "validated_at": entry.validated_at,
+        })
+
+    @staticmethod
+    def _write_meta(path, meta):
+        with open(path + META_SUFFIX + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + META_SUFFIX + ".tmp", path + META_SUFFIX)
+
+    def prune(self):
+        """
+        Evict pages that were not used for `max_age`, then the least recently used ones
+        until the cache fits into `max_size`.
+
+        @return: number of evicted pages
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(PAGE_SUFFIX):
+                    continue
+                path = os.path.join(root, name)[:-len(PAGE_SUFFIX)]
+                try:
+                    stat = os.stat(path + PAGE_SUFFIX)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        # Least recently used first
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.max_age
+        evicted = 0
+        for used_at, size, path in entries:
+            if used_at >= cutoff and total_size <= self.max_size:
+                break
+            for suffix in (PAGE_SUFFIX, META_SUFFIX):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+            total_size -= size
+            evicted += 1
+
+        if evicted:
+            logger.info(f"Evicted {evicted} pages from cache {self.directory}")
+        return evicted
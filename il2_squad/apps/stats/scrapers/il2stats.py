@@ -1,50 +1,165 @@
 """
 Scraper class for IL2 stats pages
 """
+import datetime
 import logging
-import requests
 import re
+from decimal import Decimal, InvalidOperation
+from functools import partial
 from urllib.parse import urlparse
 
-from lxml import html
 from django.contrib.auth.models import User
-from . import BaseScraper
-from django.conf import settings
+from lxml import etree
+from django.utils import timezone
+from . import BaseScraper, BaseScraperContext
+from .records import SortieRecord
+from ..models import Sortie
 
 
 logger = logging.getLogger("scraper")
-REQUEST_TIMEOUT = getattr(settings, "REQUEST_TIMEOUT", 120)  # seconds; stats servers tend to be slow
+
+
+class Il2StatsContext(BaseScraperContext):
+    """
+    Server level context for il2stats scrapers.
+    """
+    # Regexp to force an English page
+    force_en_re = re.compile(r"(http[s]*:\/\/[^\/]+)\/\w{2}\/(.*)")
+    # Regexp to get the sortie ID from a sortie URL
+    sortie_id_re = re.compile(r"/sortie/(?:log/)?(\d+)")
+    # Tour links in the navigation of any pilot page
+    tour_links_xpath = etree.XPath('//*[@id="nav_main"]//div[@class="nav_tour_items"]/a')
+    # Rows of a sorties list
+    sortie_rows_xpath = etree.XPath('//div[@class="content_table"]/a[@class="row"]')
+    # Label and value cells of the info table on top of a sortie log
+    sortie_info_xpath = etree.XPath('//div[@class="sortie_info"]/div[@class="row"]')
+    sortie_info_cells_xpath = etree.XPath('./div[@class="cell"]')
+    # Date formats used by il2stats
+    date_formats = ("%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M")
+    # Sortie states that end the pilot's virtual life
+    fatal_states = ("dead", "captured", "killed")
+
+    def __init__(self, server, concurrency=None, cache=None):
+        super().__init__(server, concurrency, cache)
+        self.tour_ids = None
+
+    def get_tour_ids(self, stats_page):
+        """
+        Get the list of the server's tours.
+
+        The tour list is the same on all pilot pages of a server, so it is only loaded once.
+
+        @param stats_page: PilotStatsPage to load the tour list from, if it isn't known yet
+        @return: list of tour IDs
+        """
+        if self.tour_ids is None:
+            tree = self.fetch_tree(stats_page.url)
+            logger.info(f"Successfully loaded {stats_page.url}")
+            tour_links = self.tour_links_xpath(tree)
+            tour_ids = [int(link.get("href").split("=")[-1]) for link in tour_links]
+            if len(tour_ids) == 0:
+                raise ValueError(f"No tours found on {stats_page}.")
+            self.tour_ids = tour_ids
+        return self.tour_ids
+
+    def parse_date(self, value):
+        """
+        Parse a date/time as shown by il2stats; returns an aware datetime or None.
+        """
+        for date_format in self.date_formats:
+            try:
+                return timezone.make_aware(datetime.datetime.strptime(value.strip(), date_format))
+            except ValueError:
+                continue
+        return None
+
+    def parse_sortie_log(self, tree, sortie_id, tour_id):
+        """
+        Build a SortieRecord from a parsed sortie log page.
+
+        @param tree: parsed sortie log page
+        @param sortie_id: ID of the sortie
+        @param tour_id: ID of the sortie's tour
+        @return: SortieRecord, or None if the page doesn't look like a sortie log
+        """
+        info = {}
+        for row in self.sortie_info_xpath(tree):
+            cells = self.sortie_info_cells_xpath(row)
+            if len(cells) >= 2:
+                info[cells[0].text_content().strip().lower()] = cells[1].text_content().strip()
+
+        start_at = self.parse_date(info.get("start", ""))
+        end_at = self.parse_date(info.get("end", ""))
+        if not info.get("aircraft") or start_at is None or end_at is None:
+            return None
+
+        def count(label):
+            try:
+                return int(info.get(label) or 0)
+            except ValueError:
+                return 0
+
+        status = info.get("status", "").lower()
+        try:
+            points = Decimal(info.get("score") or 0)
+        except InvalidOperation:
+            points = Decimal(0)
+        return SortieRecord(
+            sortie_id=sortie_id,
+            tour_id=tour_id,
+            aircraft=info["aircraft"],
+            start_at=start_at,
+            end_at=end_at,
+            air_kills=count("air kills"),
+            ground_kills=count("ground kills"),
+            ship_kills=count("ship kills"),
+            was_wounded="wounded" in status or info.get("wounded", "").lower() in ("yes", "true", "1"),
+            was_killed=any(state in status for state in self.fatal_states),
+            points=points,
+        )
 
 
 class Il2StatsScraper(BaseScraper):
     """
     Scraper class for il2stats pages.
     """
+    context_class = Il2StatsContext
 
-    def __init__(self, stats_page):
-        super().__init__(stats_page)
+    def __init__(self, stats_page, context=None):
+        super().__init__(stats_page, context)
         logger.info(f"Importing sortie data for pilot {stats_page.pilot} on server {stats_page.server}")
-        # Regexp to force an English page
-        self.force_en_re = re.compile(r"(http[s]*:\/\/[^\/]+)\/\w{2}\/(.*)")
         # Get server base URL (protocol, host, port)
         url = urlparse(stats_page.url)
         self.server_base_url = f"{url.scheme}://{url.netloc}"
 
-        # Get list of available tours
-        tour_links = self.tree.xpath('//*[@id="nav_main"]//div[@class="nav_tour_items"]/a')
-        self.tour_ids = [int(link.get("href").split("=")[-1]) for link in tour_links]
-        if len(self.tour_ids) == 0:
-            raise ValueError(f"No tours found on {stats_page}.")
-
-    def scrape(self, only_tour_id=None):
+    def scrape_tours(self, only_tour_id=None, incremental=False):
         """
-        Scrape a pilot's stats page.
+        Scrape a pilot's stats page tour by tour, see BaseScraper.scrape_tours().
+
+        The records of a tour are in the order of its sortie list.
+
+        @param only_tour_id: Optional tour ID to scrape; if omitted, scrape all tours.
+        @param incremental: Only import sorties newer than the last import; skip closed tours
+                            that were imported completely.
         """
-        # After init, we have a list of tours
-        for tour_id in self.tour_ids:
+        context = self.context
+        tour_ids = context.get_tour_ids(self.stats_page)
+        # The newest tour is the running one; all others are closed and won't get new sorties
+        current_tour_id = max(tour_ids)
+        import_states = {}
+        if incremental:
+            import_states = {state.tour_id: state for state in self.stats_page.tourimportstate_set.all()}
+
+        for tour_id in tour_ids:
             # If a tour_id is specified, only scrape that tour
             if only_tour_id is not None and tour_id != only_tour_id:
                 continue
+            import_state = import_states.get(tour_id)
+            if import_state and import_state.is_complete:
+                logger.info(f"Skipping tour {tour_id}, it is closed and fully imported")
+                continue
+            last_sortie_id = import_state.last_sortie_id if import_state else 0
+
             logger.info(f"Loading sorties for tour {tour_id}")
             # Get link to list of sorties; the sorties list URL is the same as the pilots
             # stats page, but with "sorties" instead of "pilot".
@@ -54,23 +169,57 @@ class Il2StatsScraper(BaseScraper):
             logger.info(f"Loading sortie list from {sorties_list_url}")
             sorties_list_url += f"?tour={tour_id}"
             # Load sorties, parse 
-            response = requests.get(sorties_list_url, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-            sorties_tree = html.fromstring(response.content)
-            
-            # Loop through sortie list and load each sortie
-            for sortie_row in sorties_tree.xpath('//div[@class="content_table"]/a[@class="row"]'):
+            sorties_tree = context.fetch_tree(sorties_list_url)
+
+            # Build the list of sortie log URLs first, so they can be fetched in parallel
+            sortie_urls = []
+            sortie_ids = []
+            for sortie_row in context.sortie_rows_xpath(sorties_tree):
+                match = context.sortie_id_re.search(sortie_row.get("href"))
+                if not match:
+                    logger.warning(f"No sortie ID in {sortie_row.get('href')}")
+                    continue
+                sortie_id = int(match.group(1))
+                # The list is sorted newest first, so everything from here on is known
+                if incremental and sortie_id <= last_sortie_id:
+                    break
                 # Get the sortie log; insert "log" into URL
                 sortie_url = self.server_base_url + sortie_row.get("href").replace("/sortie/", "/sortie/log/")
                 # And make sure it's in English
-                sortie_url = re.sub(self.force_en_re, r'\1/en/\2', sortie_url)
-                logging.info(f"Loading sortie from log at {sortie_url}")
-                response = requests.get(sortie_url, timeout=REQUEST_TIMEOUT)
-                response.raise_for_status()
-                sortie_log_tree = html.fromstring(response.content)
-                
-                
+                sortie_url = context.force_en_re.sub(r'\1/en/\2', sortie_url)
+                sortie_urls.append(sortie_url)
+                sortie_ids.append(sortie_id)
+
+            # High-water mark if all logs of the list can be imported
+            listed_sortie_id = max([last_sortie_id] + sortie_ids)
+
+            if incremental:
+                # Sorties may have been imported by other means (e.g. a full import of a single tour)
+                known_ids = set(Sortie.objects.filter(sortie_id__in=sortie_ids).order_by().values_list("sortie_id", flat=True))
+                new_sorties = [(url, sortie_id) for url, sortie_id in zip(sortie_urls, sortie_ids)
+                               if sortie_id not in known_ids]
+                sortie_urls = [url for url, _ in new_sorties]
+                sortie_ids = [sortie_id for _, sortie_id in new_sorties]
+                logger.info(f"{len(sortie_urls)} new sorties in tour {tour_id}")
 
+            # Logs are parsed right in the fetching threads, so only the compact records are kept.
+            # Records are handed on in sortie list order, no matter which request finishes first.
+            parse = partial(context.parse_sortie_log, tour_id=tour_id)
+            records = []
+            failed_sortie_ids = []
+            for (sortie_url, record), sortie_id in zip(context.fetch_trees(sortie_urls, sortie_ids, parse), sortie_ids):
+                if record is None:
+                    logger.warning(f"Could not parse sortie log at {sortie_url}")
+                    failed_sortie_ids.append(sortie_id)
+                    continue
+                records.append(record)
 
+            # Hand over how far we got; the writer records this with the tour's sorties. Failed
+            # logs stay above the mark, so the next incremental import retries them, and keep the
+            # tour from being complete.
+            if failed_sortie_ids:
+                listed_sortie_id = max(last_sortie_id, min(failed_sortie_ids) - 1)
+            yield tour_id, records, listed_sortie_id, tour_id != current_tour_id and not failed_sortie_ids
 
 
+Il2StatsContext.scraper_class = Il2StatsScraper
@@ -0,0 +1,60 @@
+"""
+Compact records handed from the scrapers to the downstream stages (scoring, DB writer, ...).
+"""
+from django.utils import timezone
+
+
+class SortieRecord(object):
+    """
+    A scraped sortie.
+
+    Uses __slots__, so a tour's worth of records stays small; scrapers throw away the parsed
+    pages as soon as a record has been built from them.
+
+    sortie_id       int: sortie ID on the stats site
+    tour_id         int: tour ID on the stats site
+    aircraft        str: aircraft name
+    start_at        datetime: take off / start of the sortie
+    end_at          datetime: end of the sortie
+    air_kills       int: aircraft destroyed
+    ground_kills    int: ground targets destroyed
+    ship_kills      int: ships destroyed
+    was_wounded     bool: whether the pilot was wounded
+    was_killed      bool: whether the pilot was killed or captured, i.e. the virtual life ended
+    points          Decimal: score awarded by the stats site
+    """
+    __slots__ = (
+        "sortie_id", "tour_id", "aircraft", "start_at", "end_at", "air_kills", "ground_kills",
+        "ship_kills", "was_wounded", "was_killed", "points",
+    )
+
+    def __init__(self, sortie_id, tour_id, aircraft, start_at, end_at, air_kills=0, ground_kills=0,
+                 ship_kills=0, was_wounded=False, was_killed=False, points=0):
+        self.sortie_id = sortie_id
+        self.tour_id = tour_id
+        self.aircraft = aircraft
+        self.start_at = start_at
+        self.end_at = end_at
+        self.air_kills = air_kills
+        self.ground_kills = ground_kills
+        self.ship_kills = ship_kills
+        self.was_wounded = was_wounded
+        self.was_killed = was_killed
+        self.points = points
+
+    @property
+    def flight_time(self):
+        """
+        Duration of the sortie.
+        """
+        if self.start_at is None or self.end_at is None:
+            return timezone.timedelta(0)
+        return self.end_at - self.start_at
+
+    def __eq__(self, other):
+        if not isinstance(other, SortieRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"<SortieRecord {self.sortie_id} (tour {self.tour_id}): {self.aircraft} at {self.start_at}>"
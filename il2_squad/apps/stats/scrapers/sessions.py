@@ -0,0 +1,102 @@
+"""
+Shared HTTP sessions for scrapers and pollers.
+
+All requests to a stats server go through one `requests.Session` per IL2StatsServer, so
+connections are pooled and kept alive across pages, pilots and management commands,
+instead of paying a TCP/TLS handshake for every single page.
+
+Inside use_archive(), the sessions record their traffic to an archive or replay it from there
+(see archive.py).
+"""
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+from ..instrumentation import record_response
+from .archive import ArchiveAdapter, TrafficArchive
+
+
+# Number of connections kept open per stats server; should be >= SCRAPER_CONCURRENCY
+SCRAPER_POOL_SIZE = getattr(settings, "SCRAPER_POOL_SIZE", 10)
+SCRAPER_USER_AGENT = getattr(settings, "SCRAPER_USER_AGENT", "il2-squad")
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+# TrafficArchive all sessions record to or replay from, if any
+_archive = None
+
+
+def _build_session(pool_size):
+    """
+    Create a session with a connection pool of the given size.
+    """
+    session = requests.Session()
+    session.headers.update({
+        "User-Agent": SCRAPER_USER_AGENT,
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    # Each session only talks to one server, so a single pool per scheme is enough
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    if _archive is not None:
+        adapter = ArchiveAdapter(_archive, adapter)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.pool_size = pool_size
+    # Requests are counted by instrumented runs
+    session.hooks["response"].append(record_response)
+    return session
+
+
+def get_session(server, pool_size=None):
+    """
+    Return the shared session for a stats server, creating it on first use.
+
+    Sessions are thread safe for our purposes (plain GETs), so the same session is
+    handed to all threads that scrape this server.
+
+    @param server: IL2StatsServer object
+    @param pool_size: minimum number of pooled connections needed by the caller
+    @return: requests.Session object
+    """
+    pool_size = max(pool_size or 0, SCRAPER_POOL_SIZE)
+    with _sessions_lock:
+        session = _sessions.get(server.pk)
+        if session is None or session.pool_size < pool_size:
+            # A session that is too small is replaced, not closed; other threads may still use it
+            session = _sessions[server.pk] = _build_session(pool_size)
+        return session
+
+
+@contextmanager
+def use_archive(path, mode):
+    """
+    Record all traffic of the shared sessions to an archive, or replay it from there.
+
+    Sessions are closed when entering and leaving, so none of them bypasses the archive, or keeps
+    using it afterwards.
+
+    @param path: path of the archive (a zip file)
+    @param mode: archive.MODE_RECORD or archive.MODE_REPLAY
+    """
+    global _archive
+    archive = TrafficArchive(path, mode)
+    close_sessions()
+    _archive = archive
+    try:
+        yield archive
+    finally:
+        close_sessions()
+        _archive = None
+        archive.close()
+
+
+def close_sessions():
+    """
+    Close all shared sessions and their pooled connections.
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
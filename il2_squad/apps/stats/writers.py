@@ -0,0 +1,187 @@
+"""
+Batched DB writers for scraped data.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from django.db import transaction
+from .aggregates import apply_sorties
+from .models import Aircraft, Sortie, VirtualLife, TourImportState, POINTS_FIELDS
+from .scoring import ScoringEngine
+
+
+logger = logging.getLogger("management")
+
+
+class SortieWriter(object):
+    """
+    Writes scraped sorties (SortieRecord objects) to the DB, one tour at a time.
+
+    Each tour is written in one transaction with a constant number of queries: aircraft are
+    resolved through an in-process map, overlaps are checked in one query against the pilot's
+    existing sorties and in memory against the batch, and sorties are inserted with one
+    bulk_create. The DB's exclusion constraint backs this up. The sorties are split into lives in
+    memory; new lives are inserted and ended ones updated in bulk as well. New sorties are scored
+    as one batch, and the totals of the lives are updated with them in one statement.
+    """
+
+    def __init__(self, engine=None):
+        # Scores the new sorties; a ScoringEngine with the configured rules by default
+        self.engine = engine or ScoringEngine()
+        # Aircraft name -> ID; preloaded once, extended when new aircraft show up
+        self.aircraft_ids = dict(Aircraft.objects.values_list("name", "id"))
+        # Number of sorties written/skipped by this writer
+        self.created = 0
+        self.skipped = 0
+        # (server ID, tour ID) pairs of the tours that got new sorties; their leaderboards are out of date
+        self.tours = set()
+
+    def resolve_aircraft(self, names):
+        """
+        Make sure all aircraft names are known, creating the missing ones in one query.
+        """
+        missing = set(names) - set(self.aircraft_ids)
+        if missing:
+            for aircraft in Aircraft.objects.bulk_create([Aircraft(name=name) for name in sorted(missing)]):
+                self.aircraft_ids[aircraft.name] = aircraft.id
+
+    @staticmethod
+    def find_overlaps(records, existing):
+        """
+        Find records that overlap each other or existing sorties of the same pilot.
+
+        Uses the same rule as Sortie.clean(): intervals touching each other count as overlapping.
+
+        @param records: SortieRecord objects of one pilot
+        @param existing: list of (start_at, end_at) tuples of the pilot's stored sorties
+        @return: set of sortie IDs of the overlapping records; of two overlapping records,
+                 the later one is reported
+        """
+        # Sweep over all intervals ordered by start; stored sorties win over new ones
+        intervals = [(start_at, 0, end_at, None) for start_at, end_at in existing]
+        intervals += [(record.start_at, 1, record.end_at, record.sortie_id) for record in records]
+        intervals.sort(key=lambda interval: (interval[0], interval[1]))
+        overlapping = set()
+        latest_end = None
+        for start_at, _, end_at, sortie_id in intervals:
+            if latest_end is not None and start_at <= latest_end:
+                if sortie_id is not None:
+                    overlapping.add(sortie_id)
+                    continue
+            if latest_end is None or end_at > latest_end:
+                latest_end = end_at
+        return overlapping
+
+    def validate(self, pilot, records):
+        """
+        Find the records of a tour that overlap the pilot's stored sorties or each other.
+
+        Stored sorties are checked in one index backed query, the batch itself in memory.
+
+        @param pilot: User object
+        @param records: SortieRecord objects of the pilot
+        @return: set of sortie IDs of the overlapping records
+        """
+        overlapping = Sortie.find_overlapping(
+            pilot.id, [(record.sortie_id, record.start_at, record.end_at) for record in records])
+        return overlapping | self.find_overlaps(
+            [record for record in records if record.sortie_id not in overlapping], [])
+
+    def write_tour(self, stats_page, tour_id, records, last_sortie_id=None, is_complete=False):
+        """
+        Write one tour's sorties of a pilot and record the import progress.
+
+        @param stats_page: PilotStatsPage the records were scraped from
+        @param tour_id: ID of the tour
+        @param records: list of SortieRecord objects
+        @param last_sortie_id: high-water mark of the tour, as walked by the scraper (see
+                               BaseScraper.scrape_tours()); defaults to the highest ID of the records
+        @param is_complete: whether the tour is closed and was walked completely
+        @return: list of created Sortie objects
+        """
+        pilot = stats_page.pilot
+        with transaction.atomic():
+            # Sorties that are already stored are skipped (e.g. on a full re-import)
+            known_ids = set(Sortie.objects.filter(
+                sortie_id__in=[record.sortie_id for record in records]
+            ).order_by().values_list("sortie_id", flat=True))
+            records = sorted((record for record in records if record.sortie_id not in known_ids),
+                             key=lambda record: record.start_at)
+
+            sorties = []
+            if records:
+                overlapping = self.validate(pilot, records)
+                for sortie_id in sorted(overlapping):
+                    logger.warning(f"Skipping sortie {sortie_id} of {pilot}: timely overlapping sortie already exists.")
+                records = [record for record in records if record.sortie_id not in overlapping]
+                self.skipped += len(overlapping)
+
+            if records:
+                self.resolve_aircraft(record.aircraft for record in records)
+                # Sorties are added to the pilot's latest life, unless that one has ended already
+                life = VirtualLife.objects.filter(pilot=pilot).order_by("-number").first()
+                number = life.number if life else 0
+                if life and life.end_date is not None:
+                    life = None
+                points = self.engine.score_records(records)
+                new_lives = []
+                ended_lives = []
+                for record, record_points in zip(records, points):
+                    if life is None:
+                        number += 1
+                        life = self.new_life(pilot, number, record)
+                        new_lives.append(life)
+                    sorties.append(Sortie(
+                        virtual_life=life,
+                        pilot=pilot,
+                        server_id=stats_page.server_id,
+                        aircraft_id=self.aircraft_ids[record.aircraft],
+                        start_at=record.start_at,
+                        end_at=record.end_at,
+                        was_wounded=record.was_wounded,
+                        air_kills=record.air_kills,
+                        ground_kills=record.ground_kills,
+                        ship_kills=record.ship_kills,
+                        tour_id=tour_id,
+                        sortie_id=record.sortie_id,
+                        site_points=record.points,
+                        **record_points,
+                    ))
+                    # Killed or captured: the next sortie starts a new life
+                    if record.was_killed:
+                        life.end_date = record.end_at.date()
+                        if life.pk is not None:
+                            ended_lives.append(life)
+                        life = None
+                # The sorties pick up the IDs of their new lives on insert
+                VirtualLife.objects.bulk_create(new_lives)
+                VirtualLife.objects.bulk_update(ended_lives, ["end_date"])
+                Sortie.objects.bulk_create(sorties)
+                apply_sorties(sorties)
+                self.created += len(sorties)
+                self.tours.add((stats_page.server_id, tour_id))
+
+            # Progress is recorded in the same transaction as the sorties
+            if last_sortie_id is None:
+                last_sortie_id = max([0] + [record.sortie_id for record in records])
+            TourImportState.record(stats_page, tour_id, last_sortie_id, is_complete=is_complete)
+        return sorties
+
+    @staticmethod
+    def new_life(pilot, number, record):
+        """
+        Build a new (unsaved) virtual life for a pilot, starting with the given sortie.
+        """
+        return VirtualLife(
+            pilot=pilot,
+            start_date=record.start_at.date(),
+            number=number,
+            # The field's default (0) is not a valid interval for PostgreSQL
+            flight_time=timedelta(0),
+            was_wounded=False,
+            air_kills=0,
+            ground_kills=0,
+            ship_kills=0,
+            **{field: Decimal(0) for field in POINTS_FIELDS},
+        )
+
@@ -178,6 +178,46 @@ LOGGING["loggers"]["management"] = {
 
 SQUAD_TAG = "JG27_"
 PLAYER_OCCURRENCE_MAX_DELTA_MINUTES = 60
+# Raw player occurrences older than this are deleted by prune_occurrences (None: keep forever);
+# poll snapshots and population rollups are kept
+PLAYER_OCCURRENCE_RETENTION_DAYS = None
+# Monthly partitions of player occurrences are created this many months ahead
+PLAYER_OCCURRENCE_PARTITIONS_AHEAD = 3
+# Player sessions are split when a server's polls are missing for more than this many poll intervals
+ONLINE_SESSION_MAX_GAP_POLLS = 3
+# The "stats" cache holds the hot stats lookups (stats.caching): pilot names, player counts, squad members,
+# leaderboard pages. Being file based, it is shared by all processes of a host (pollers, importers, web
+# workers), so their invalidations reach each other; for several hosts, use a shared backend, e.g.
+#   "stats": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://127.0.0.1:6379"}
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "stats": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "cache", "stats"),
+    },
+}
+# Cache alias and times to live (seconds) of the stats lookups; entries are invalidated on write anyway
+STATS_CACHE = "stats"
+PILOT_NAME_CACHE_TTL = 24 * 60 * 60
+PLAYER_CNT_CACHE_TTL = 60 * 60
+SQUAD_MEMBERS_CACHE_TTL = 60 * 60
+LEADERBOARD_CACHE_TTL = 24 * 60 * 60
+# Directory of node_exporter's textfile collector; if set, import_sorties and online_players write the
+# numbers of each run (HTTP, parse time, DB queries, written rows) to <command>.prom there
+INSTRUMENTATION_PROMETHEUS_DIR = None
+# Admin lists of huge tables (player occurrences) count exactly only below this estimated number of rows
+ESTIMATED_COUNT_THRESHOLD = 10000
+# Rules scoring the sorties' point fields from their stats (see stats.scoring); by default, the score awarded
+# by the stats site becomes the sortie points. After changing them, run rescore_sorties.
+SCORING_RULES = {
+    "sortie_points": {"site_points": 1},
+}
+# Number of pages fetched in parallel from a single stats server (import_sorties --concurrency)
+SCRAPER_CONCURRENCY = 4
+# On-disk cache of sortie logs, which never change once a sortie is finished
+SCRAPER_CACHE_DIR = os.path.join(BASE_DIR, "cache", "scraper")
 
 # --- NO SETTINGS BELOW THIS BLOCK -----------------------------------------------------------
 